@@ -0,0 +1,125 @@
+import asyncio
+import time
+from backend.metrics import ADMISSION_REJECTED, LIMITER_ACTIVE, LIMITER_WAITING, BREAKER_OPEN
+
+# Backpressure for the Ollama-bound part of the chat path. Generation runs
+# behind a bounded limiter with a capped queue, Ollama calls go through a
+# circuit breaker, and anything that can't be served soon is refused with
+# Overloaded, which the server turns into a fast 503 + Retry-After.
+
+
+class Overloaded(Exception):
+    """The request can't be served now; retry after `retry_after` seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class Limiter:
+    """At most `limit` holders at once and at most `queue_limit` waiting for a slot"""
+
+    def __init__(self, name, limit, queue_limit, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self.sem = asyncio.Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+
+    def check(self):
+        """Refuse early when the queue is already full"""
+        if self.active >= self.limit and self.waiting >= self.queue_limit:
+            ADMISSION_REJECTED.labels(self.name, "queue_full").inc()
+            raise Overloaded(f"{self.name} queue is full", self.queue_timeout)
+
+    async def __aenter__(self):
+        self.check()
+        self.waiting += 1
+        LIMITER_WAITING.labels(self.name).set(self.waiting)
+        try:
+            await asyncio.wait_for(self.sem.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            ADMISSION_REJECTED.labels(self.name, "queue_timeout").inc()
+            raise Overloaded(f"no {self.name} slot within {self.queue_timeout:g}s", self.queue_timeout)
+        finally:
+            self.waiting -= 1
+            LIMITER_WAITING.labels(self.name).set(self.waiting)
+        self.active += 1
+        LIMITER_ACTIVE.labels(self.name).set(self.active)
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        LIMITER_ACTIVE.labels(self.name).set(self.active)
+        self.sem.release()
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after `failures` consecutive errors.
+
+    While open every call fails fast with Overloaded; after `reset_seconds`
+    one trial call is let through (half-open) and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, name, failures, reset_seconds):
+        self.name = name
+        self.failures = failures
+        self.reset_seconds = reset_seconds
+        self.consecutive = 0
+        self.opened_at = None
+
+    def remaining(self):
+        """Seconds until the next trial call is allowed; 0 when calls may go through"""
+        if self.opened_at is None:
+            return 0
+        return max(0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def is_open(self):
+        """Peek without taking the half-open trial (for admission checks)"""
+        return self.remaining() > 0
+
+    def check(self):
+        """Gate an actual call; when half-open, this call becomes the trial"""
+        if self.opened_at is None:
+            return
+        remaining = self.remaining()
+        if remaining > 0:
+            ADMISSION_REJECTED.labels(self.name, "circuit_open").inc()
+            raise Overloaded(f"{self.name} circuit is open", remaining)
+        # Half-open: this call is the trial; others wait out another reset period
+        self.opened_at = time.monotonic()
+
+    def success(self):
+        self.consecutive = 0
+        if self.opened_at is not None:
+            self.opened_at = None
+            BREAKER_OPEN.labels(self.name).set(0)
+
+    def failure(self):
+        self.consecutive += 1
+        if self.consecutive >= self.failures or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+            BREAKER_OPEN.labels(self.name).set(1)
+
+
+class ClientDisconnected(Exception):
+    """The HTTP client went away before the answer was ready"""
+
+
+async def cancel_on_disconnect(request, coro, poll=0.25):
+    """Await `coro`, cancelling it if the HTTP client goes away first"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,161 @@
+import logging
+import time
+import sqlalchemy as sa
+from sqlalchemy import text
+from backend.config import DB_DSN
+from backend.metrics import setup_logging
+
+log = logging.getLogger(__name__)
+
+# Precomputed stat tables built from player_box_scores and game_details, so the
+# chat path answers leader/record questions with indexed point lookups instead
+# of whole-table aggregations. They are plain tables rather than materialized
+# views so they can be refreshed incrementally: per-game tables only for the
+# games that changed, season tables only for the seasons those games belong to.
+# agg_player_season has one row per team stint (for team-scoped questions);
+# agg_player_totals sums a traded player's stints into one season row.
+
+AGG_TABLES = ["agg_game_leaders", "agg_triple_doubles", "agg_player_season", "agg_player_totals", "agg_team_records", "agg_head_to_head"]
+
+DDL = [
+    """CREATE TABLE IF NOT EXISTS agg_game_leaders (
+        game_id bigint NOT NULL,
+        team_id bigint NOT NULL,
+        top_scorer_id bigint, top_points integer,
+        top_rebounder_id bigint, top_rebounds integer,
+        top_assister_id bigint, top_assists integer,
+        PRIMARY KEY (game_id, team_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS agg_triple_doubles (
+        game_id bigint NOT NULL,
+        person_id bigint NOT NULL,
+        team_id bigint NOT NULL,
+        season integer NOT NULL,
+        points integer NOT NULL, rebounds integer NOT NULL, assists integer NOT NULL,
+        PRIMARY KEY (game_id, person_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS agg_triple_doubles_person ON agg_triple_doubles (person_id, season)",
+    """CREATE TABLE IF NOT EXISTS agg_player_season (
+        season integer NOT NULL,
+        person_id bigint NOT NULL,
+        team_id bigint NOT NULL,
+        games integer NOT NULL,
+        points integer NOT NULL, rebounds integer NOT NULL, assists integer NOT NULL,
+        high_points integer NOT NULL,
+        high_points_game_id bigint NOT NULL,
+        PRIMARY KEY (season, person_id, team_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS agg_player_season_team ON agg_player_season (season, team_id, points DESC)",
+    """CREATE TABLE IF NOT EXISTS agg_player_totals (
+        season integer NOT NULL,
+        person_id bigint NOT NULL,
+        games integer NOT NULL,
+        points integer NOT NULL, rebounds integer NOT NULL, assists integer NOT NULL,
+        high_points integer NOT NULL,
+        high_points_game_id bigint NOT NULL,
+        PRIMARY KEY (season, person_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS agg_player_totals_points ON agg_player_totals (season, points DESC)",
+    "CREATE INDEX IF NOT EXISTS agg_player_totals_high ON agg_player_totals (season, high_points DESC)",
+    """CREATE TABLE IF NOT EXISTS agg_team_records (
+        season integer NOT NULL,
+        team_id bigint NOT NULL,
+        wins integer NOT NULL, losses integer NOT NULL,
+        points_for integer NOT NULL, points_against integer NOT NULL,
+        PRIMARY KEY (season, team_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS agg_head_to_head (
+        season integer NOT NULL,
+        team_id bigint NOT NULL,
+        opponent_id bigint NOT NULL,
+        games integer NOT NULL, wins integer NOT NULL, losses integer NOT NULL,
+        PRIMARY KEY (team_id, opponent_id, season)
+    )""",
+]
+
+# Per-game tables, limited to the games in :game_ids (leaders are per team)
+GAME_REFRESH = [
+    "DELETE FROM agg_game_leaders WHERE game_id = ANY(:game_ids)",
+    """INSERT INTO agg_game_leaders
+       SELECT s.game_id, s.team_id, s.person_id, s.points, r.person_id, r.rebounds, a.person_id, a.assists
+       FROM (SELECT DISTINCT ON (game_id, team_id) game_id, team_id, person_id, points FROM player_box_scores
+             WHERE game_id = ANY(:game_ids) ORDER BY game_id, team_id, points DESC, person_id) s
+       JOIN (SELECT DISTINCT ON (game_id, team_id) game_id, team_id, person_id, offensive_reb + defensive_reb AS rebounds
+             FROM player_box_scores WHERE game_id = ANY(:game_ids)
+             ORDER BY game_id, team_id, offensive_reb + defensive_reb DESC, person_id) r
+         ON r.game_id = s.game_id AND r.team_id = s.team_id
+       JOIN (SELECT DISTINCT ON (game_id, team_id) game_id, team_id, person_id, assists FROM player_box_scores
+             WHERE game_id = ANY(:game_ids) ORDER BY game_id, team_id, assists DESC, person_id) a
+         ON a.game_id = s.game_id AND a.team_id = s.team_id""",
+    "DELETE FROM agg_triple_doubles WHERE game_id = ANY(:game_ids)",
+    """INSERT INTO agg_triple_doubles
+       SELECT b.game_id, b.person_id, b.team_id, g.season, b.points, b.offensive_reb + b.defensive_reb, b.assists
+       FROM player_box_scores b JOIN game_details g ON g.game_id = b.game_id
+       WHERE b.game_id = ANY(:game_ids)
+         AND b.points >= 10 AND b.assists >= 10 AND b.offensive_reb + b.defensive_reb >= 10""",
+]
+
+# Season tables, limited to the seasons in :seasons
+SEASON_REFRESH = [
+    "DELETE FROM agg_player_season WHERE season = ANY(:seasons)",
+    """INSERT INTO agg_player_season
+       SELECT g.season, b.person_id, b.team_id, count(*), sum(b.points),
+              sum(b.offensive_reb + b.defensive_reb), sum(b.assists),
+              max(b.points), (array_agg(b.game_id ORDER BY b.points DESC, g.game_timestamp))[1]
+       FROM player_box_scores b JOIN game_details g ON g.game_id = b.game_id
+       WHERE g.season = ANY(:seasons)
+       GROUP BY g.season, b.person_id, b.team_id""",
+    "DELETE FROM agg_player_totals WHERE season = ANY(:seasons)",
+    """INSERT INTO agg_player_totals
+       SELECT g.season, b.person_id, count(*), sum(b.points),
+              sum(b.offensive_reb + b.defensive_reb), sum(b.assists),
+              max(b.points), (array_agg(b.game_id ORDER BY b.points DESC, g.game_timestamp))[1]
+       FROM player_box_scores b JOIN game_details g ON g.game_id = b.game_id
+       WHERE g.season = ANY(:seasons)
+       GROUP BY g.season, b.person_id""",
+    "DELETE FROM agg_team_records WHERE season = ANY(:seasons)",
+    """INSERT INTO agg_team_records
+       SELECT season, team_id, count(*) FILTER (WHERE pf > pa), count(*) FILTER (WHERE pf < pa), sum(pf), sum(pa)
+       FROM (SELECT season, home_team_id AS team_id, home_points AS pf, away_points AS pa FROM game_details
+             UNION ALL
+             SELECT season, away_team_id, away_points, home_points FROM game_details) t
+       WHERE season = ANY(:seasons)
+       GROUP BY season, team_id""",
+    "DELETE FROM agg_head_to_head WHERE season = ANY(:seasons)",
+    """INSERT INTO agg_head_to_head
+       SELECT season, team_id, opponent_id, count(*), count(*) FILTER (WHERE pf > pa), count(*) FILTER (WHERE pf < pa)
+       FROM (SELECT season, home_team_id AS team_id, away_team_id AS opponent_id, home_points AS pf, away_points AS pa
+             FROM game_details
+             UNION ALL
+             SELECT season, away_team_id, home_team_id, away_points, home_points FROM game_details) t
+       WHERE season = ANY(:seasons)
+       GROUP BY season, team_id, opponent_id""",
+]
+
+
+def refresh_aggregates(cx, game_ids=None):
+    """Rebuild aggregates for the given games (and their seasons), or everything when game_ids is None"""
+    for stmt in DDL:
+        cx.execute(text(stmt))
+    if game_ids is None:
+        cx.execute(text(f"TRUNCATE {', '.join(AGG_TABLES)}"))
+        game_ids = cx.execute(text("SELECT game_id FROM game_details")).scalars().all()
+    game_ids = [int(g) for g in game_ids]
+    if not game_ids:
+        return 0
+    seasons = cx.execute(
+        text("SELECT DISTINCT season FROM game_details WHERE game_id = ANY(:game_ids)"), {"game_ids": game_ids}
+    ).scalars().all()
+    for stmt in GAME_REFRESH:
+        cx.execute(text(stmt), {"game_ids": game_ids})
+    for stmt in SEASON_REFRESH:
+        cx.execute(text(stmt), {"seasons": list(seasons)})
+    return len(game_ids)
+
+
+if __name__ == "__main__":
+    setup_logging()
+    started = time.perf_counter()
+    with sa.create_engine(DB_DSN).begin() as cx:
+        n = refresh_aggregates(cx)
+    log.info("Refreshed aggregates for %d games in %.2fs", n, time.perf_counter() - started)
@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import subprocess
+import sys
+import time
+import httpx
+import numpy as np
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response, StreamingResponse
+
+# Stand-in for the parts of the Ollama API this repo calls: /api/embeddings,
+# /api/embed and /api/generate (plain and streamed). Vectors are derived from
+# a hash of the input text, so the same text always embeds to the same unit
+# vector, and every endpoint sleeps for a configurable time to model the GPU.
+#
+#   python -m backend.bench.fake_ollama --port 11435 --token-ms 20
+#   OLLAMA_HOST=http://127.0.0.1:11435 uvicorn backend.server:app
+
+DIM = 768
+ANSWER = "The Oklahoma City Thunder won the game 120-110 behind 35 points from Shai Gilgeous-Alexander."
+
+
+class Latency:
+    """Simulated model latency, in milliseconds"""
+
+    def __init__(self, embed_ms=15.0, embed_item_ms=2.0, prefill_ms=150.0, token_ms=25.0, tokens=40):
+        self.embed_ms = embed_ms            # per embedding request
+        self.embed_item_ms = embed_item_ms  # extra per text in a batch
+        self.prefill_ms = prefill_ms        # before the first generated token
+        self.token_ms = token_ms            # per generated token
+        self.tokens = tokens                # tokens per answer (capped by num_predict)
+
+
+def fake_vector(text, dim=DIM):
+    """Deterministic unit vector for a text"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    v = np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def fake_tokens(n):
+    words = ANSWER.split(" ")
+    return [(" " if i else "") + words[i % len(words)] for i in range(n)]
+
+
+def json_response(data):
+    # FastAPI's encoder would turn the vectors into Python floats first, which
+    # makes the fake slower than the client it is benchmarking
+    return Response(orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
+
+
+def create_app(latency=None):
+    latency = latency or Latency()
+    app = FastAPI()
+    app.state.latency = latency
+
+    @app.post("/api/embeddings")
+    async def embeddings(req: Request):
+        body = await req.json()
+        await asyncio.sleep((latency.embed_ms + latency.embed_item_ms) / 1000)
+        return json_response({"embedding": fake_vector(body["prompt"])})
+
+    @app.post("/api/embed")
+    async def embed(req: Request):
+        body = await req.json()
+        texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep((latency.embed_ms + latency.embed_item_ms * len(texts)) / 1000)
+        return json_response({"model": body.get("model"), "embeddings": np.stack([fake_vector(t) for t in texts])})
+
+    @app.post("/api/generate")
+    async def generate(req: Request):
+        body = await req.json()
+        prompt = body.get("prompt", "")
+        n = min(latency.tokens, (body.get("options") or {}).get("num_predict", latency.tokens))
+        if not prompt:
+            # Empty prompt just loads the model (keep_alive warm-up)
+            return {"model": body.get("model"), "response": "", "done": True}
+        tokens = fake_tokens(n)
+        # Rough token count for the prompt, so prompt_eval_count looks plausible;
+        # durations are in nanoseconds like Ollama's
+        stats = {"prompt_eval_count": len(prompt) // 4, "eval_count": n,
+                 "prompt_eval_duration": int(latency.prefill_ms * 1e6),
+                 "eval_duration": int(latency.token_ms * n * 1e6)}
+
+        if not body.get("stream", True):
+            await asyncio.sleep((latency.prefill_ms + latency.token_ms * n) / 1000)
+            return {"model": body.get("model"), "response": "".join(tokens), "done": True, **stats}
+
+        async def lines():
+            await asyncio.sleep(latency.prefill_ms / 1000)
+            for tok in tokens:
+                await asyncio.sleep(latency.token_ms / 1000)
+                yield json.dumps({"model": body.get("model"), "response": tok, "done": False}) + "\n"
+            yield json.dumps({"model": body.get("model"), "response": "", "done": True, **stats}) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/api/tags")
+    async def tags():
+        return {"models": []}
+
+    return app
+
+
+def spawn(port, latency=None, host="127.0.0.1"):
+    """Start the fake server in a child process (so it doesn't share the
+    benchmark's GIL); returns (process, base URL) once it accepts requests"""
+    latency = latency or Latency()
+    proc = subprocess.Popen([
+        sys.executable, "-m", "backend.bench.fake_ollama", "--host", host, "--port", str(port),
+        "--embed-ms", str(latency.embed_ms), "--embed-item-ms", str(latency.embed_item_ms),
+        "--prefill-ms", str(latency.prefill_ms), "--token-ms", str(latency.token_ms),
+        "--tokens", str(latency.tokens),
+    ])
+    url = f"http://{host}:{port}"
+    for _ in range(300):
+        try:
+            httpx.get(url + "/api/tags", timeout=1)
+            return proc, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    proc.terminate()
+    raise RuntimeError("fake Ollama did not start")
+
+
+def add_latency_args(ap):
+    d = Latency()
+    ap.add_argument("--embed-ms", type=float, default=d.embed_ms)
+    ap.add_argument("--embed-item-ms", type=float, default=d.embed_item_ms)
+    ap.add_argument("--prefill-ms", type=float, default=d.prefill_ms)
+    ap.add_argument("--token-ms", type=float, default=d.token_ms)
+    ap.add_argument("--tokens", type=int, default=d.tokens)
+
+
+def latency_from_args(args):
+    return Latency(args.embed_ms, args.embed_item_ms, args.prefill_ms, args.token_ms, args.tokens)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Fake Ollama server for offline benchmarks")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    add_latency_args(ap)
+    args = ap.parse_args(argv)
+    uvicorn.run(create_app(latency_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
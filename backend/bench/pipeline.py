@@ -0,0 +1,101 @@
+import argparse
+import importlib
+import os
+import time
+from backend.bench.fake_ollama import add_latency_args, latency_from_args, spawn
+
+# Throughput of the batch jobs. Both scenarios run the real job code; the
+# embed scenario points it at a fake Ollama (fake_ollama.py), so
+# the numbers measure text building, batching and the database writes rather
+# than a model. Run against a throwaway database: ingest drops and reloads
+# every table in DB_DSN (see chat_load.py for a one-line pgvector container).
+#
+#   python -m backend.bench.pipeline ingest --repeat 3
+#   python -m backend.bench.pipeline embed --force --embed-item-ms 0.5
+#   python -m backend.bench.pipeline embed --no-db     # no Postgres: CSVs in, vectors discarded
+
+
+def bench_ingest(args):
+    ingest = importlib.import_module("backend.ingest")
+    times = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        ingest.main([])
+        times.append(time.perf_counter() - started)
+    rows = sum(sum(1 for _ in open(os.path.join(ingest.DATA_DIR, f"{t}.csv"), encoding="utf-8")) - 1
+               for t in ingest.TABLES)
+    best = min(times)
+    print(f"ingest: {rows} rows, best of {len(times)} {best:.2f}s ({rows / best:,.0f} rows/sec)")
+
+
+def bench_embed(args):
+    embed = importlib.import_module("backend.embed")
+    embed.setup_logging()
+    if args.no_db:
+        return bench_embed_offline(embed)
+    if args.force:
+        import sqlalchemy as sa
+        from sqlalchemy import text
+        with sa.create_engine(embed.DB_DSN).begin() as cx:
+            for table in ("game_details", "player_box_scores"):
+                cx.execute(text(f"UPDATE {table} SET embedding_hash = NULL"))
+    started = time.perf_counter()
+    n_games, n_players = embed.main([])
+    elapsed = time.perf_counter() - started
+    rows = n_games + n_players
+    print(f"embed: {rows} rows in {elapsed:.2f}s ({rows / elapsed:,.1f} rows/sec end to end)")
+
+
+def bench_embed_offline(embed):
+    """Text building and batched embedding from the CSVs, without Postgres"""
+    import pandas as pd
+    from backend.ingest import DATA_DIR
+    from backend.refdata import team_names, player_names
+
+    def csv(name):
+        return pd.read_csv(os.path.join(DATA_DIR, f"{name}.csv"))
+
+    teams, players = team_names(csv("teams")), player_names(csv("players"))
+    games, box = csv("game_details"), csv("player_box_scores")
+    started = time.perf_counter()
+    texts = embed.game_texts(games, teams) + embed.player_texts(box, teams, players)
+    build = time.perf_counter() - started
+    print(f"texts: {len(texts)} built in {build:.2f}s ({len(texts) / build:,.0f} rows/sec)")
+
+    # Same batching and concurrency as embed_rows, with the write step dropped
+    embed.write_vectors = lambda *args: None
+    keys = [(i,) for i in range(len(texts))]
+    started = time.perf_counter()
+    n = embed.embed_rows(None, "bench", ["id"], keys, texts, [""] * len(texts), "bench")
+    elapsed = time.perf_counter() - started
+    print(f"embed: {n} rows in {elapsed:.2f}s ({n / elapsed:,.1f} rows/sec, "
+          f"batch {embed.EMBED_BATCH_SIZE}, concurrency {embed.EMBED_CONCURRENCY})")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Ingest and embed throughput")
+    sub = ap.add_subparsers(dest="scenario", required=True)
+    p = sub.add_parser("ingest", help="COPY the CSVs into DB_DSN (drops existing tables)")
+    p.add_argument("--repeat", type=int, default=1)
+    p = sub.add_parser("embed", help="embed stale rows against a fake Ollama")
+    p.add_argument("--force", action="store_true", help="re-embed every row")
+    p.add_argument("--no-db", action="store_true", help="read the CSVs and discard vectors instead of writing")
+    p.add_argument("--ollama-port", type=int, default=11435)
+    add_latency_args(p)
+    args = ap.parse_args(argv)
+
+    if args.scenario == "ingest":
+        bench_ingest(args)
+    else:
+        fake, url = spawn(args.ollama_port, latency_from_args(args))
+        # Before backend.config is imported, so the job talks to the fake
+        os.environ["OLLAMA_HOST"] = url
+        try:
+            bench_embed(args)
+        finally:
+            fake.terminate()
+            fake.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import io
+import time
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import text
+from backend.config import DB_DSN, EMBED_MODEL, EMBED_BATCH_SIZE, EMBED_STORAGE
+from backend.vindex import TABLE_KEYS
+
+# Storage precision vs. index size, build time, latency and recall@k. A sample
+# of one table's rows is re-embedded through Ollama at full float32 precision
+# (the stored column may already be halfvec), copied into scratch tables as
+# vector (float32), halfvec (float16) and halfvec plus a binary-quantized
+# Hamming index with re-ranking, each gets its HNSW index, and the same
+# sampled queries run against all of them. Exact float32 search over the
+# re-embedded sample is the ground truth. --stored skips the re-embedding and
+# uses the stored vectors; recall is then relative to EMBED_STORAGE.
+#
+#   python -m backend.bench.quantization --table player_box_scores --corpus 5000 --queries 200 --k 10
+
+DIM = 768
+VARIANTS = {
+    "vector": {
+        "column": f"vector({DIM})",
+        "index": "USING hnsw (embedding vector_cosine_ops)",
+        "query": "SELECT id FROM {t} ORDER BY embedding <=> CAST(:q AS vector) LIMIT :k",
+    },
+    "halfvec": {
+        "column": f"halfvec({DIM})",
+        "index": "USING hnsw (embedding halfvec_cosine_ops)",
+        "query": "SELECT id FROM {t} ORDER BY embedding <=> CAST(:q AS halfvec) LIMIT :k",
+    },
+    "binary+rerank": {
+        "column": f"halfvec({DIM})",
+        "index": f"USING hnsw ((binary_quantize(embedding)::bit({DIM})) bit_hamming_ops)",
+        "query": (
+            "SELECT id FROM ("
+            f"  SELECT id, embedding FROM {{t}} ORDER BY binary_quantize(embedding)::bit({DIM}) "
+            f"  <~> binary_quantize(CAST(:q AS halfvec))::bit({DIM}) LIMIT :cand"
+            ") c ORDER BY embedding <=> CAST(:q AS halfvec) LIMIT :k"
+        ),
+    },
+}
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f"p50 {np.percentile(ms, 50):.2f} ms, p95 {np.percentile(ms, 95):.2f} ms"
+
+
+def literal(vec):
+    return "[" + ",".join(map(repr, vec.tolist())) + "]"
+
+
+# Columns embed.game_texts / embed.player_texts need
+TEXT_COLUMNS = {
+    "game_details": "game_id, season, game_timestamp, home_team_id, away_team_id, home_points, away_points",
+    "player_box_scores": ("game_id, person_id, team_id, starter, seconds, points, assists, "
+                          "offensive_reb, defensive_reb, steals, blocks"),
+}
+
+
+def reembed(eng, table, limit):
+    """Float32 embeddings for a fixed sample of rows, rebuilt from their texts"""
+    import pandas as pd
+    from backend import embed
+    from backend.refdata import load_names
+    from backend.utils import ollama_embed_batch
+
+    teams, players = load_names(eng)
+    keys = ", ".join(TABLE_KEYS[table])
+    df = pd.read_sql(f"SELECT {TEXT_COLUMNS[table]} FROM {table} ORDER BY md5(({keys})::text) LIMIT {limit}", eng)
+    texts = embed.game_texts(df, teams) if table == "game_details" else embed.player_texts(df, teams, players)
+    vectors = []
+    for lo in range(0, len(texts), EMBED_BATCH_SIZE):
+        vectors.extend(ollama_embed_batch(EMBED_MODEL, texts[lo:lo + EMBED_BATCH_SIZE]))
+    return np.array(vectors, dtype=np.float32)
+
+
+def load_scratch(eng, name, column, vectors):
+    """Create a scratch table and COPY the vectors in; returns seconds"""
+    buf = io.StringIO()
+    for i, v in enumerate(vectors):
+        buf.write(f"{i}\t{literal(v)}\n")
+    buf.seek(0)
+    started = time.perf_counter()
+    with eng.begin() as cx:
+        cx.execute(text(f"DROP TABLE IF EXISTS {name}"))
+        cx.execute(text(f"CREATE TABLE {name} (id bigint PRIMARY KEY, embedding {column})"))
+        cx.connection.dbapi_connection.cursor().copy_expert(f"COPY {name} (id, embedding) FROM STDIN", buf)
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="vector vs halfvec vs binary-quantized HNSW")
+    ap.add_argument("--table", default="player_box_scores", choices=sorted(TABLE_KEYS))
+    ap.add_argument("--corpus", type=int, default=5000, help="rows re-embedded at float32")
+    ap.add_argument("--stored", action="store_true",
+                    help="use the stored embeddings instead of re-embedding (ground truth at EMBED_STORAGE precision)")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--ef-search", type=int, default=40)
+    ap.add_argument("--rerank-factor", type=int, default=10, help="binary candidates per result")
+    ap.add_argument("--maintenance-work-mem", default="512MB", help="for the index builds")
+    ap.add_argument("--keep", action="store_true", help="leave the scratch tables in place")
+    args = ap.parse_args(argv)
+
+    eng = sa.create_engine(DB_DSN)
+    if args.stored:
+        with eng.connect() as cx:
+            rows = cx.execute(text(
+                f"SELECT embedding::real[] FROM {args.table} WHERE embedding IS NOT NULL"
+            )).scalars().all()
+        if not rows:
+            raise SystemExit(f"{args.table} has no embeddings yet; run backend/embed.py first")
+        exact = np.array(rows, dtype=np.float32)
+        truth_label = f"exact search over the stored {EMBED_STORAGE} vectors"
+    else:
+        exact = reembed(eng, args.table, args.corpus)
+        if not len(exact):
+            raise SystemExit(f"{args.table} is empty; run backend/ingest.py first")
+        truth_label = "exact search over float32 re-embeddings"
+    exact /= np.linalg.norm(exact, axis=1, keepdims=True)
+
+    rng = np.random.default_rng(0)
+    picks = rng.choice(len(exact), size=min(args.queries, len(exact)), replace=False)
+    queries = exact[picks] + rng.normal(0, 0.01, size=(len(picks), DIM)).astype(np.float32)
+    truth = []
+    for q in queries:
+        sims = exact @ (q / np.linalg.norm(q))
+        truth.append(set(np.argpartition(-sims, args.k - 1)[:args.k].tolist()))
+
+    print(f"{args.table}: {len(exact)} vectors, {len(queries)} queries, k={args.k}, ef_search={args.ef_search}")
+    print(f"  ground truth: {truth_label}")
+    cand = args.k * args.rerank_factor
+    for variant, spec in VARIANTS.items():
+        name = "bench_q_" + variant.replace("+", "_")
+        load_secs = load_scratch(eng, name, spec["column"], exact)
+        with eng.begin() as cx:
+            cx.execute(text(f"SET LOCAL maintenance_work_mem = '{args.maintenance_work_mem}'"))
+            started = time.perf_counter()
+            cx.execute(text(f"CREATE INDEX {name}_idx ON {name} {spec['index']}"))
+            build_secs = time.perf_counter() - started
+            cx.execute(text(f"ANALYZE {name}"))
+        with eng.connect() as cx:
+            index_mb, table_mb = cx.execute(text(
+                f"SELECT pg_relation_size('{name}_idx') / 1e6, pg_table_size('{name}') / 1e6"
+            )).one()
+            cx.execute(text(f"SET hnsw.ef_search = {max(args.ef_search, cand if 'binary' in variant else args.k)}"))
+            sql = text(spec["query"].format(t=name))
+            times, recall = [], []
+            for q, expected in zip(queries, truth):
+                params = {"q": literal(q), "k": args.k, "cand": cand}
+                started = time.perf_counter()
+                ids = cx.execute(sql, params).scalars().all()
+                times.append(time.perf_counter() - started)
+                recall.append(len(expected & set(ids)) / args.k)
+        if not args.keep:
+            with eng.begin() as cx:
+                cx.execute(text(f"DROP TABLE {name}"))
+        print(f"  {variant:14s} table {table_mb:7.1f} MB, index {index_mb:7.1f} MB, load {load_secs:6.2f}s, "
+              f"index build {build_secs:6.2f}s, {percentiles(times)}, recall@{args.k} {np.mean(recall):.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import time
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import text
+from backend.config import DB_DSN, VECTOR_INDEX_DIR, EMBED_STORAGE
+from backend.vindex import LocalIndex, TABLE_KEYS
+
+# Compare pgvector HNSW retrieval with the in-process snapshot (vindex.py).
+# Query vectors are sampled from the stored embeddings, so no Ollama is needed.
+# Exact float32 search over the snapshot is the ground truth for recall@k.
+#
+#   python -m backend.vindex                 # export a snapshot first
+#   python -m backend.bench.vector_index --table player_box_scores --queries 200 --k 10
+
+
+def percentiles(samples):
+    ms = np.array(samples) * 1000
+    return f"p50 {np.percentile(ms, 50):.2f} ms, p95 {np.percentile(ms, 95):.2f} ms, mean {ms.mean():.2f} ms"
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="pgvector HNSW vs local snapshot retrieval")
+    ap.add_argument("--table", default="player_box_scores", choices=sorted(TABLE_KEYS))
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--ef-search", type=int, default=40, help="hnsw.ef_search for the pgvector runs")
+    ap.add_argument("--dir", default=VECTOR_INDEX_DIR)
+    args = ap.parse_args(argv)
+
+    local = LocalIndex(args.table, args.dir)
+    exact = local.vectors.astype(np.float32)
+    rng = np.random.default_rng(0)
+    # Perturb sampled rows a little so queries are not exact copies of a stored vector
+    picks = rng.choice(len(exact), size=min(args.queries, len(exact)), replace=False)
+    queries = exact[picks] + rng.normal(0, 0.01, size=(len(picks), exact.shape[1])).astype(np.float32)
+
+    def truth(q):
+        sims = exact @ (q / np.linalg.norm(q))
+        top = np.argpartition(-sims, args.k - 1)[:args.k]
+        return {tuple(int(x) for x in local.keys[i]) for i in top}
+
+    key_cols = TABLE_KEYS[args.table]
+    eng = sa.create_engine(DB_DSN)
+    pg_times, pg_recall, local_times, local_recall = [], [], [], []
+    with eng.connect() as cx:
+        cx.execute(text(f"SET hnsw.ef_search = {int(args.ef_search)}"))
+        sql = text(
+            f"SELECT {', '.join(key_cols)} FROM {args.table} WHERE embedding IS NOT NULL "
+            f"ORDER BY embedding <=> CAST(:q AS {EMBED_STORAGE}) LIMIT :k"
+        )
+        for q in queries:
+            expected = truth(q)
+            literal = "[" + ",".join(map(repr, q.tolist())) + "]"
+
+            t0 = time.perf_counter()
+            rows = cx.execute(sql, {"q": literal, "k": args.k}).all()
+            pg_times.append(time.perf_counter() - t0)
+            pg_recall.append(len(expected & {tuple(int(x) for x in r) for r in rows}) / args.k)
+
+            t0 = time.perf_counter()
+            hits = local.search(q, args.k)
+            local_times.append(time.perf_counter() - t0)
+            local_recall.append(len(expected & {key for key, _ in hits}) / args.k)
+
+    mode = "hnswlib" if local.ann is not None else f"exact {local.vectors.dtype}"
+    print(f"{args.table}: {len(exact)} vectors, {len(queries)} queries, k={args.k}")
+    print(f"  pgvector HNSW (ef_search={args.ef_search}): {percentiles(pg_times)}, recall@{args.k} {np.mean(pg_recall):.3f}")
+    print(f"  local {mode}: {percentiles(local_times)}, recall@{args.k} {np.mean(local_recall):.3f}")
+
+
+if __name__ == "__main__":
+    main()
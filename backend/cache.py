@@ -0,0 +1,115 @@
+import re
+import time
+from collections import OrderedDict
+import numpy as np
+from sqlalchemy import text
+
+# In-process caches for the chat server, plus the data-version stamp that
+# ingest.py/embed.py bump so running servers know to drop cached results.
+# The bump is also announced with NOTIFY on DATA_VERSION_CHANNEL (delivered at
+# commit), so listening servers react at once instead of on their next poll.
+
+DATA_VERSION_DDL = "CREATE TABLE IF NOT EXISTS data_version (id int PRIMARY KEY, version bigint NOT NULL)"
+DATA_VERSION_BUMP = (
+    "INSERT INTO data_version (id, version) VALUES (1, 1) "
+    "ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1 RETURNING version"
+)
+DATA_VERSION_CHANNEL = "data_version"
+
+
+def bump_data_version(cx):
+    """Mark the data as changed so servers invalidate their caches"""
+    cx.execute(text(DATA_VERSION_DDL))
+    version = cx.execute(text(DATA_VERSION_BUMP)).scalar()
+    cx.execute(text("SELECT pg_notify(:channel, :version)"), {"channel": DATA_VERSION_CHANNEL, "version": str(version)})
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return re.sub(r"\s+", " ", question.strip().lower()).rstrip("?!. ")
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def items(self):
+        """Unexpired (key, value) pairs, without touching LRU order or counters"""
+        now = time.monotonic()
+        return [(k, v) for k, (expires, v) in self._data.items() if expires >= now]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class AnswerCache:
+    """Answers keyed by (question, evidence ids, model).
+
+    With a semantic threshold > 0, a miss on the exact question falls back to
+    any cached answer with the same evidence and model whose question
+    embedding has cosine similarity >= threshold.
+    """
+
+    def __init__(self, maxsize, ttl, semantic_threshold=0.0):
+        self.entries = TTLCache(maxsize, ttl)
+        self.semantic_threshold = semantic_threshold
+        self.semantic_hits = 0
+
+    def _key(self, question, evidence, model):
+        return (normalize_question(question), tuple((e["table"], e["id"]) for e in evidence), model)
+
+    def get(self, question, qvec, evidence, model):
+        key = self._key(question, evidence, model)
+        hit = self.entries.get(key)
+        if hit is not None:
+            return hit[1]
+        if self.semantic_threshold <= 0:
+            return None
+
+        q = np.asarray(qvec, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        for (_, ev, mdl), (vec, answer) in self.entries.items():
+            if ev == key[1] and mdl == model and float(vec @ q) >= self.semantic_threshold:
+                self.semantic_hits += 1
+                return answer
+        return None
+
+    def put(self, question, qvec, evidence, model, answer):
+        vec = np.asarray(qvec, dtype=np.float32)
+        vec /= np.linalg.norm(vec) or 1.0
+        self.entries.put(self._key(question, evidence, model), (vec, answer))
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {**self.entries.stats(), "semantic_hits": self.semantic_hits,
+                "semantic_threshold": self.semantic_threshold}
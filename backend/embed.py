@@ -1,152 +1,288 @@
+import argparse
+import hashlib
+import io
+import logging
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import text
-from backend.config import DB_DSN, EMBED_MODEL
-from backend.utils import ollama_embed
-
-
-def get_team_name(team_id, teams_df):
-    """Get team name from team_id"""
-    team = teams_df[teams_df['team_id'] == team_id]
-    if not team.empty:
-        return f"{team.iloc[0]['city']} {team.iloc[0]['name']}"
-    return f"Team_{team_id}"
-
-def get_player_name(player_id, players_df):
-    """Get player name from player_id"""
-    player = players_df[players_df['player_id'] == player_id]
-    if not player.empty:
-        return f"{player.iloc[0]['first_name']} {player.iloc[0]['last_name']}"
-    return f"Player_{player_id}"
-
-def game_row_text(r, teams_df):
-    """Enhanced game embedding with team names and readable format"""
-    ts = pd.to_datetime(r.game_timestamp, utc=True)
-    date = ts.strftime('%B %d, %Y')  
-    
-    home_team = get_team_name(r.home_team_id, teams_df)
-    away_team = get_team_name(r.away_team_id, teams_df)
+from backend.config import (
+    DB_DSN, EMBED_MODEL, EMBED_BATCH_SIZE, EMBED_CONCURRENCY, EMBED_COMMIT_EVERY, RETRIEVAL_BACKEND,
+    EMBED_STORAGE, EMBED_BINARY_INDEX,
+)
+from backend.utils import ollama_embed_batch, vector_literal
+from backend.refdata import load_names, map_team_names, map_player_names
+from backend.cache import bump_data_version
+from backend.vindex import export_snapshot
+from backend.metrics import ROWS_EMBEDDED, EMBED_ROWS_PER_SECOND, push_job_metrics, setup_logging, span
+
+log = logging.getLogger(__name__)
+
+DIM = 768
+OPCLASS = {"vector": "vector_cosine_ops", "halfvec": "halfvec_cosine_ops"}
+
+
+def game_texts(df, teams):
+    """Enhanced game embedding texts with team names, built in one columnar pass"""
+    date = pd.to_datetime(df["game_timestamp"], utc=True).dt.strftime('%B %d, %Y')
+    home_team = map_team_names(df["home_team_id"], teams)
+    away_team = map_team_names(df["away_team_id"], teams)
+    home_pts = df["home_points"].astype(str)
+    away_pts = df["away_points"].astype(str)
     
     # Determine winner
-    if r.home_points > r.away_points:
-        winner = home_team
-        final_score = f"{r.home_points}-{r.away_points}"
-    else:
-        winner = away_team
-        final_score = f"{r.away_points}-{r.home_points}"
+    home_won = df["home_points"] > df["away_points"]
+    winner = home_team.where(home_won, away_team)
+    final_score = (home_pts + "-" + away_pts).where(home_won, away_pts + "-" + home_pts)
     
-    return (
-        f"NBA Game on {date}: {away_team} vs {home_team}. "
-        f"Final score: {home_team} {r.home_points}, {away_team} {r.away_points}. "
-        f"Winner: {winner} ({final_score}). "
-        f"Season: {r.season}-{r.season+1}. "
-        f"Game ID: {r.game_id}"
+    texts = (
+        "NBA Game on " + date + ": " + away_team + " vs " + home_team + ". "
+        + "Final score: " + home_team + " " + home_pts + ", " + away_team + " " + away_pts + ". "
+        + "Winner: " + winner + " (" + final_score + "). "
+        + "Season: " + df["season"].astype(str) + "-" + (df["season"] + 1).astype(str) + ". "
+        + "Game ID: " + df["game_id"].astype(str)
     )
+    return texts.tolist()
 
-def player_row_text(r, teams_df, players_df):
-    """Create embedding text for player box scores"""
-    player_name = get_player_name(r.person_id, players_df)
-    team_name = get_team_name(r.team_id, teams_df)
-    
-    # Create readable stats summary
-    stats_parts = []
-    if r.points > 0:
-        stats_parts.append(f"{r.points} points")
-    if r.assists > 0:
-        stats_parts.append(f"{r.assists} assists")
-    if r.defensive_reb + r.offensive_reb > 0:
-        total_reb = r.defensive_reb + r.offensive_reb
-        stats_parts.append(f"{total_reb} rebounds")
-    if r.steals > 0:
-        stats_parts.append(f"{r.steals} steals")
-    if r.blocks > 0:
-        stats_parts.append(f"{r.blocks} blocks")
-    
-    stats_text = ", ".join(stats_parts) if stats_parts else "0 points"
-    
-    # Check for notable performances
-    performance_notes = []
-    if r.points >= 30:
-        performance_notes.append("high scoring game")
-    if r.assists >= 10:
-        performance_notes.append("double-digit assists")
-    if (r.defensive_reb + r.offensive_reb) >= 10:
-        performance_notes.append("double-digit rebounds")
-    if r.points >= 10 and r.assists >= 10 and (r.defensive_reb + r.offensive_reb) >= 10:
-        performance_notes.append("triple-double")
-    
-    performance_text = " (" + ", ".join(performance_notes) + ")" if performance_notes else ""
-    
-    return (
-        f"Player performance: {player_name} from {team_name} scored {stats_text} "
-        f"in game {r.game_id}{performance_text}. "
-        f"Starter: {'Yes' if r.starter else 'No'}. "
-        f"Minutes played: {r.seconds/60:.1f}"
+def _stats_text(points, assists, total_reb, steals, blocks):
+    """Readable stats summary for one box score"""
+    parts = []
+    if points > 0:
+        parts.append(f"{points} points")
+    if assists > 0:
+        parts.append(f"{assists} assists")
+    if total_reb > 0:
+        parts.append(f"{total_reb} rebounds")
+    if steals > 0:
+        parts.append(f"{steals} steals")
+    if blocks > 0:
+        parts.append(f"{blocks} blocks")
+    return ", ".join(parts) if parts else "0 points"
+
+def _performance_text(points, assists, total_reb):
+    """Notable-performance suffix for one box score"""
+    notes = []
+    if points >= 30:
+        notes.append("high scoring game")
+    if assists >= 10:
+        notes.append("double-digit assists")
+    if total_reb >= 10:
+        notes.append("double-digit rebounds")
+    if points >= 10 and assists >= 10 and total_reb >= 10:
+        notes.append("triple-double")
+    return " (" + ", ".join(notes) + ")" if notes else ""
+
+def player_texts(df, teams, players):
+    """Embedding texts for player box scores, built from whole columns at once"""
+    player_name = map_player_names(df["person_id"], players).tolist()
+    team_name = map_team_names(df["team_id"], teams).tolist()
+    total_reb = (df["defensive_reb"] + df["offensive_reb"]).tolist()
+    minutes = (df["seconds"] / 60).tolist()
+    cols = zip(
+        player_name, team_name, df["game_id"].tolist(), df["points"].tolist(), df["assists"].tolist(),
+        total_reb, df["steals"].tolist(), df["blocks"].tolist(), df["starter"].tolist(), minutes,
     )
+    return [
+        f"Player performance: {name} from {team} scored {_stats_text(pts, ast, reb, stl, blk)} "
+        f"in game {gid}{_performance_text(pts, ast, reb)}. "
+        f"Starter: {'Yes' if starter else 'No'}. "
+        f"Minutes played: {mins:.1f}"
+        for name, team, gid, pts, ast, reb, stl, blk, starter, mins in cols
+    ]
+
+
+def text_hash(content):
+    """Content hash of an embedding text, used to skip rows that haven't changed"""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def stale_rows(df, texts):
+    """Positions of rows whose text or model differs from what was last embedded"""
+    hashes = [text_hash(t) for t in texts]
+    stale = [
+        i for i, (h, old_h, old_m) in enumerate(zip(hashes, df["embedding_hash"], df["embedding_model"]))
+        if h != old_h or old_m != EMBED_MODEL
+    ]
+    return stale, hashes
+
+def write_vectors(eng, table, key_cols, keys, hashes, vectors):
+    """Bulk-write embeddings: COPY into a staging table, then a single UPDATE ... FROM"""
+    buf = io.StringIO()
+    for key, h, vec in zip(keys, hashes, vectors):
+        buf.write("\t".join(str(int(k)) for k in key) + f"\t{h}\t" + vector_literal(vec) + "\n")
+    buf.seek(0)
+
+    key_defs = ", ".join(f"{c} bigint" for c in key_cols)
+    join = " AND ".join(f"t.{c} = s.{c}" for c in key_cols)
+    with eng.begin() as cx:
+        cur = cx.connection.dbapi_connection.cursor()
+        cur.execute(f"CREATE TEMP TABLE embed_stage ({key_defs}, embedding_hash text, embedding {EMBED_STORAGE}({DIM})) ON COMMIT DROP")
+        cur.copy_expert(f"COPY embed_stage ({', '.join(key_cols)}, embedding_hash, embedding) FROM STDIN", buf)
+        cur.execute(
+            f"UPDATE {table} t SET embedding = s.embedding, embedding_hash = s.embedding_hash, "
+            f"embedding_model = %s FROM embed_stage s WHERE {join}",
+            (EMBED_MODEL,),
+        )
 
+def setup_embedding_columns(cx, table):
+    """Add the embedding columns and indexes, converting an existing column to EMBED_STORAGE"""
+    column = f"{EMBED_STORAGE}({DIM})"
+    cx.execute(text(f"ALTER TABLE IF EXISTS {table} ADD COLUMN IF NOT EXISTS embedding {column}"))
+    cx.execute(text(f"ALTER TABLE IF EXISTS {table} ADD COLUMN IF NOT EXISTS embedding_hash text"))
+    cx.execute(text(f"ALTER TABLE IF EXISTS {table} ADD COLUMN IF NOT EXISTS embedding_model text"))
+    current = cx.execute(text(
+        "SELECT format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = CAST(:t AS regclass) AND attname = 'embedding'"
+    ), {"t": table}).scalar()
+    if current != column:
+        # Indexes are built per type, so drop them and rebuild after the conversion
+        log.info("Converting %s.embedding from %s to %s", table, current, column)
+        cx.execute(text(f"DROP INDEX IF EXISTS idx_{table}_embedding"))
+        cx.execute(text(f"DROP INDEX IF EXISTS idx_{table}_embedding_bq"))
+        cx.execute(text(f"ALTER TABLE {table} ALTER COLUMN embedding TYPE {column} USING embedding::{column}"))
+    cx.execute(text(
+        f"CREATE INDEX IF NOT EXISTS idx_{table}_embedding ON {table} USING hnsw (embedding {OPCLASS[EMBED_STORAGE]})"
+    ))
+    if EMBED_BINARY_INDEX:
+        # Expression index over the sign bits; nothing extra is stored in the table
+        cx.execute(text(
+            f"CREATE INDEX IF NOT EXISTS idx_{table}_embedding_bq ON {table} "
+            f"USING hnsw ((binary_quantize(embedding)::bit({DIM})) bit_hamming_ops)"
+        ))
+    else:
+        cx.execute(text(f"DROP INDEX IF EXISTS idx_{table}_embedding_bq"))
+
+
+def embed_rows(eng, table, key_cols, keys, texts, hashes, label):
+    """Embed texts in batches with a bounded number of requests in flight.
+
+    Finished vectors are written back and committed every EMBED_COMMIT_EVERY
+    rows together with their content hash, so an interrupted run resumes
+    from the last committed chunk.
+    """
+    total = len(texts)
+    done = 0
+    pending_keys, pending_hashes, pending_vecs = [], [], []
+    started = time.perf_counter()
+
+    def flush():
+        nonlocal done
+        if not pending_keys:
+            return
+        with span(f"embed.write.{table}"):
+            write_vectors(eng, table, key_cols, pending_keys, pending_hashes, pending_vecs)
+        ROWS_EMBEDDED.labels(table).inc(len(pending_keys))
+        done += len(pending_keys)
+        pending_keys.clear()
+        pending_hashes.clear()
+        pending_vecs.clear()
+        rate = done / max(time.perf_counter() - started, 1e-9)
+        EMBED_ROWS_PER_SECOND.labels(table).set(rate)
+        log.info("%s: %d/%d rows committed (%.1f rows/sec)", label, done, total, rate)
 
-def main():
-    print("Starting Enhanced Embedding Process")
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        in_flight = deque()
+        for lo in range(0, total, EMBED_BATCH_SIZE):
+            hi = min(lo + EMBED_BATCH_SIZE, total)
+            in_flight.append((keys[lo:hi], hashes[lo:hi], pool.submit(ollama_embed_batch, EMBED_MODEL, texts[lo:hi])))
+            # Keep at most EMBED_CONCURRENCY batches outstanding
+            while len(in_flight) >= EMBED_CONCURRENCY:
+                batch_keys, batch_hashes, fut = in_flight.popleft()
+                pending_keys.extend(batch_keys)
+                pending_hashes.extend(batch_hashes)
+                pending_vecs.extend(fut.result())
+                if len(pending_keys) >= EMBED_COMMIT_EVERY:
+                    flush()
+        while in_flight:
+            batch_keys, batch_hashes, fut = in_flight.popleft()
+            pending_keys.extend(batch_keys)
+            pending_hashes.extend(batch_hashes)
+            pending_vecs.extend(fut.result())
+        flush()
+    return done
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Embed new and changed rows")
+    ap.add_argument("--pending", action="store_true",
+                    help="only rows queued by an incremental ingest (no embedding hash yet) instead of checking every row")
+    args = ap.parse_args(argv)
+    # Pending rows have no hash, so stale_rows picks all of them
+    where = "WHERE embedding_hash IS NULL " if args.pending else ""
+    setup_logging()
+    log.info("Starting Enhanced Embedding Process")
     eng = sa.create_engine(DB_DSN)
     
     # Load reference data for team and player names
-    print("Loading reference data...")
-    teams_df = pd.read_sql("SELECT team_id, city, name, abbreviation FROM teams", eng)
-    players_df = pd.read_sql("SELECT player_id, first_name, last_name FROM players", eng)
+    log.info("Loading reference data...")
+    with span("embed.load_names"):
+        teams, players = load_names(eng)
     
     with eng.begin() as cx:
         cx.execute(text('ALTER DATABASE nba REFRESH COLLATION VERSION'))
         
-        # Setup game_details embeddings
-        print("Setting up game_details embeddings...")
-        cx.execute(text("ALTER TABLE IF EXISTS game_details ADD COLUMN IF NOT EXISTS embedding vector(768);"))
-        cx.execute(text("CREATE INDEX IF NOT EXISTS idx_game_details_embedding ON game_details USING hnsw (embedding vector_cosine_ops);"))
-        
-        # Setup player_box_scores embeddings
-        print("Setting up player_box_scores embeddings...")
-        cx.execute(text("ALTER TABLE IF EXISTS player_box_scores ADD COLUMN IF NOT EXISTS embedding vector(768);"))
-        cx.execute(text("CREATE INDEX IF NOT EXISTS idx_player_box_scores_embedding ON player_box_scores USING hnsw (embedding vector_cosine_ops);"))
-        
-        # Process game_details embeddings
-        print("Processing game_details embeddings...")
-        games_df = pd.read_sql(
-            "SELECT game_id, season, game_timestamp, home_team_id, away_team_id, home_points, away_points FROM game_details ORDER BY game_timestamp DESC, game_id DESC",
-            cx,
-        )
-        
-        for i, (_, r) in enumerate(games_df.iterrows()):
-            if i % 100 == 0:
-                print(f"  Processed {i}/{len(games_df)} games...")
-            text_content = game_row_text(r, teams_df)
-            vec = ollama_embed(EMBED_MODEL, text_content)
-            cx.execute(text("UPDATE game_details SET embedding = :v WHERE game_id = :gid"), 
-                      {"v": vec, "gid": int(r.game_id)})
-        
-        # Process player_box_scores embeddings (sample for performance)
-        print("Processing player_box_scores embeddings...")
-        players_df_filtered = pd.read_sql(
-            """SELECT game_id, person_id, team_id, starter, seconds, points, fg2_made, fg2_attempted, 
-                      fg3_made, fg3_attempted, ft_attempted, ft_made, offensive_reb, defensive_reb, 
-                      assists, steals, blocks, turnovers, defensive_fouls, offensive_fouls 
-               FROM player_box_scores 
-               WHERE points >= 20 OR assists >= 8 OR (defensive_reb + offensive_reb) >= 10 
-                     OR (points >= 10 AND assists >= 10 AND (defensive_reb + offensive_reb) >= 10)
-               ORDER BY points DESC, assists DESC
-               LIMIT 5000""",
-            cx,
-        )
+        # Setup embedding columns; hash/model track what each vector was built from
+        for table in ("game_details", "player_box_scores"):
+            log.info("Setting up %s embeddings (%s)...", table, EMBED_STORAGE)
+            setup_embedding_columns(cx, table)
         
-        for i, (_, r) in enumerate(players_df_filtered.iterrows()):
-            if i % 100 == 0:
-                print(f"  Processed {i}/{len(players_df_filtered)} player performances...")
-            text_content = player_row_text(r, teams_df, players_df)
-            vec = ollama_embed(EMBED_MODEL, text_content)
-            cx.execute(text("UPDATE player_box_scores SET embedding = :v WHERE game_id = :gid AND person_id = :pid"), 
-                      {"v": vec, "gid": int(r.game_id), "pid": int(r.person_id)})
+    # Process game_details embeddings (only new, changed or other-model rows)
+    log.info("Processing game_details embeddings...")
+    games_df = pd.read_sql(
+        "SELECT game_id, season, game_timestamp, home_team_id, away_team_id, home_points, away_points, "
+        f"embedding_hash, embedding_model FROM game_details {where}ORDER BY game_timestamp DESC, game_id DESC",
+        eng,
+    )
+    with span("embed.texts.game_details"):
+        game_docs = game_texts(games_df, teams)
+        stale, hashes = stale_rows(games_df, game_docs)
+    log.info("%d/%d games need embedding", len(stale), len(games_df))
+    n_games = embed_rows(
+        eng, "game_details", ["game_id"],
+        [(games_df.game_id.iat[i],) for i in stale],
+        [game_docs[i] for i in stale],
+        [hashes[i] for i in stale],
+        "games",
+    )
+    
+    # Process player_box_scores embeddings (all rows, incrementally)
+    log.info("Processing player_box_scores embeddings...")
+    box_df = pd.read_sql(
+        f"""SELECT game_id, person_id, team_id, starter, seconds, points, fg2_made, fg2_attempted, 
+                  fg3_made, fg3_attempted, ft_attempted, ft_made, offensive_reb, defensive_reb, 
+                  assists, steals, blocks, turnovers, defensive_fouls, offensive_fouls,
+                  embedding_hash, embedding_model
+           FROM player_box_scores {where}
+           ORDER BY points DESC, assists DESC""",
+        eng,
+    )
+    with span("embed.texts.player_box_scores"):
+        player_docs = player_texts(box_df, teams, players)
+        stale, hashes = stale_rows(box_df, player_docs)
+    log.info("%d/%d player performances need embedding", len(stale), len(box_df))
+    n_players = embed_rows(
+        eng, "player_box_scores", ["game_id", "person_id"],
+        [(box_df.game_id.iat[i], box_df.person_id.iat[i]) for i in stale],
+        [player_docs[i] for i in stale],
+        [hashes[i] for i in stale],
+        "player performances",
+    )
+    
+    if n_games or n_players:
+        with eng.begin() as cx:
+            bump_data_version(cx)
+    
+    # Refresh the in-process retrieval snapshot
+    if RETRIEVAL_BACKEND == "local":
+        log.info("Exporting embedding snapshot for local retrieval...")
+        with span("embed.export_snapshot"):
+            export_snapshot(eng)
     
-    print(f"Finished Enhanced Embeddings:")
-    print(f"  - {len(games_df)} game_details rows updated")
-    print(f"  - {len(players_df_filtered)} player_box_scores rows updated")
+    log.info("Finished Enhanced Embeddings: %d game_details rows, %d player_box_scores rows updated",
+             n_games, n_players)
+    push_job_metrics("embed")
+    return n_games, n_players
 
 
 if __name__ == "__main__":
@@ -0,0 +1,434 @@
+import re
+import unicodedata
+from datetime import date, timedelta
+from sqlalchemy import text
+
+# Deterministic answers for structured stat questions. A question is parsed
+# into an intent plus slots (teams, players, date, points) and mapped onto a
+# parameterized SQL template; anything that doesn't parse falls back to RAG.
+# Leader, record and season questions read the precomputed agg_* tables
+# (aggregates.py) rather than aggregating box scores per request.
+
+MONTHS = {
+    m: i + 1 for i, m in enumerate(
+        ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
+    )
+}
+HOLIDAYS = {"christmas": (12, 25), "new year's eve": (12, 31), "new years eve": (12, 31),
+            "new year's day": (1, 1), "new years day": (1, 1)}
+
+# Common nicknames on top of city, name and abbreviation from the teams table
+NICKNAMES = {
+    "LAL": ["la lakers"], "LAC": ["la clippers", "los angeles clippers"], "PHI": ["sixers"],
+    "CLE": ["cavs"], "DAL": ["mavs"], "MIN": ["wolves", "t-wolves"], "POR": ["blazers"],
+    "NOP": ["pels"], "OKC": ["okc"], "GSW": ["dubs"],
+}
+
+MONTH_DAY_YEAR = re.compile(
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b"
+)
+NUMERIC_DATE = re.compile(r"\b(\d{1,2})[/-](\d{1,2})[/-](\d{2}|\d{4})\b")
+MONTH_DAY = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+SEASON = re.compile(r"\b(\d{4})(?:-\d{2,4})?\s+(?:nba\s+)?season\b")
+YEAR = re.compile(r"\b(20\d{2})\b")
+POINTS = re.compile(r"\b(\d{1,3})\s*(?:points|pts)\b")
+SCORE = re.compile(r"\b(\d{2,3})\s*-\s*(\d{2,3})\b")
+
+
+def ascii_fold(s):
+    """Strip accents so "Dončić" matches "Doncic" """
+    return unicodedata.normalize("NFKD", s).encode("ascii", "ignore").decode()
+
+
+def fold(s):
+    return ascii_fold(s).lower()
+
+
+def blank(s, start, end):
+    """Replace s[start:end] with spaces, keeping positions stable"""
+    return s[:start] + " " * (end - start) + s[end:]
+
+
+class SlotParser:
+    """Finds teams, players, dates and point totals in a question"""
+
+    def __init__(self, ref):
+        # Names for answers come from the shared reference data (refdata.RefData)
+        self.ref = ref
+        team_rows, player_rows = ref.team_rows, ref.player_rows
+
+        cities = {}
+        for r in team_rows:
+            cities.setdefault(fold(r["city"]), []).append(int(r["team_id"]))
+        aliases = {}
+        for r in team_rows:
+            tid = int(r["team_id"])
+            aliases[fold(f"{r['city']} {r['name']}")] = tid
+            aliases[fold(r["name"])] = tid
+            city = fold(r["city"])
+            if len(cities[city]) == 1 and len(city) > 2:
+                aliases[city] = tid
+            for nick in NICKNAMES.get(r["abbreviation"], []):
+                aliases[nick] = tid
+        self.team_aliases = aliases
+        self.team_re = self._alternation(aliases)
+        abbrs = {r["abbreviation"]: int(r["team_id"]) for r in team_rows}
+        self.abbr_ids = abbrs
+        self.abbr_re = re.compile(r"\b(" + "|".join(map(re.escape, abbrs)) + r")\b") if abbrs else None
+
+        players = {}
+        for r in player_rows:
+            players[fold(f"{r['first_name']} {r['last_name']}")] = int(r["player_id"])
+        self.player_aliases = players
+        self.player_re = self._alternation(players)
+
+    @staticmethod
+    def _alternation(aliases):
+        if not aliases:
+            return None
+        # Longest alias first so "la lakers" wins over "lakers"
+        names = sorted(aliases, key=len, reverse=True)
+        return re.compile(r"\b(" + "|".join(map(re.escape, names)) + r")\b")
+
+    def parse_date(self, q):
+        """Return (date or None, text with the date blanked out)"""
+        m = MONTH_DAY_YEAR.search(q)
+        if m:
+            return self._date(int(m.group(3)), MONTHS[m.group(1)], int(m.group(2))), blank(q, *m.span())
+        m = NUMERIC_DATE.search(q)
+        if m:
+            year = int(m.group(3))
+            year = year + 2000 if year < 100 else year
+            return self._date(year, int(m.group(1)), int(m.group(2))), blank(q, *m.span())
+        for name, (month, day) in HOLIDAYS.items():
+            i = q.find(name)
+            y = YEAR.search(q)
+            if i >= 0 and y:
+                return self._date(int(y.group(1)), month, day), blank(q, i, i + len(name))
+        m = MONTH_DAY.search(q)
+        s = SEASON.search(q)
+        if m and s:
+            # A season starts in October, so spring dates belong to the next calendar year
+            month, day = int(m.group(1)), int(m.group(2))
+            year = int(s.group(1)) + (0 if month >= 8 else 1)
+            return self._date(year, month, day), blank(q, *m.span())
+        return None, q
+
+    @staticmethod
+    def _date(y, m, d):
+        try:
+            return date(y, m, d)
+        except ValueError:
+            return None
+
+    def parse(self, question):
+        """Extract slots from a question"""
+        raw = ascii_fold(question)
+        q = raw.lower()
+        game_date, rest = self.parse_date(q)
+
+        player_ids = []
+        if self.player_re:
+            for m in self.player_re.finditer(rest):
+                pid = self.player_aliases[m.group(1)]
+                if pid not in player_ids:
+                    player_ids.append(pid)
+                rest = blank(rest, *m.span())
+
+        found = []
+        if self.team_re:
+            found += [(m.start(), self.team_aliases[m.group(1)]) for m in self.team_re.finditer(rest)]
+        if self.abbr_re:
+            # Abbreviations only count in upper case ("OKC", not "min")
+            raw_rest = "".join(c if r != " " else " " for c, r in zip(raw, rest))
+            found += [(m.start(), self.abbr_ids[m.group(1)]) for m in self.abbr_re.finditer(raw_rest)]
+        team_ids = []
+        for _, tid in sorted(found):
+            if tid not in team_ids:
+                team_ids.append(tid)
+
+        pts = POINTS.search(rest)
+        score = SCORE.search(rest)
+        season = SEASON.search(rest)
+        return {
+            "text": q,
+            "date": game_date,
+            "season": int(season.group(1)) if season else None,
+            "score": tuple(sorted(map(int, score.groups()), reverse=True)) if score else None,
+            "teams": team_ids,
+            "players": player_ids,
+            "points": int(pts.group(1)) if pts else None,
+        }
+
+
+def retrieval_filters(parser, question):
+    """Metadata filters for hybrid retrieval (see retrieval.py), or None if the question has none"""
+    slots = parser.parse(question)
+    date_from = date_to = None
+    if slots["date"] is not None:
+        date_from, date_to = slots["date"], slots["date"] + timedelta(days=1)
+    elif slots["season"] is not None:
+        # Regular season plus playoffs
+        date_from, date_to = date(slots["season"], 8, 1), date(slots["season"] + 1, 8, 1)
+    if date_from is None and not slots["teams"] and not slots["players"]:
+        return None
+    return {"date_from": date_from, "date_to": date_to, "teams": slots["teams"][:2], "players": slots["players"]}
+
+
+def build_parser(ref):
+    """Build a SlotParser from the teams and players reference data (refdata.RefData)"""
+    return SlotParser(ref)
+
+
+def classify(slots):
+    """Map parsed slots onto an intent name, or None when nothing fits"""
+    q = slots["text"]
+    anchored = slots["date"] is not None or slots["score"] is not None
+    has_game = anchored and (slots["teams"] or slots["players"])
+    if slots["season"] is not None and not anchored:
+        if ("head-to-head" in q or "head to head" in q or "season series" in q) and len(slots["teams"]) >= 2:
+            return "head_to_head"
+        if "record" in q and slots["teams"] and not slots["players"]:
+            return "team_record"
+        if "season high" in q or "career high" in q or ("most points" in q and "game" in q):
+            return "season_high"
+        if "leading scorer" in q or "top scorer" in q or "most points" in q:
+            return "scoring_leader"
+    if ("triple-double" in q or "triple double" in q) and has_game:
+        return "triple_double"
+    # Leaders are stored per team, so the question has to name one
+    if ("leading scorer" in q or "top scorer" in q or re.search(r"\bled\b.*\bscoring\b", q)) and anchored \
+            and slots["teams"]:
+        return "leading_scorer"
+    if ("won" in q or "winner" in q) and anchored and slots["teams"] and not slots["players"]:
+        return "game_winner"
+    # Unanchored debuts are only answered when the player's first season is in the data (see plan)
+    if slots["players"] and "point" in q and (anchored or "debut" in q):
+        return "player_points"
+    if "player" in q and slots["points"] is not None and slots["date"]:
+        return "player_with_points"
+    if "points" in q and slots["teams"] and anchored and not slots["players"]:
+        return "team_points"
+    return None
+
+
+def _game_filters(slots, anchor, alias="g"):
+    """WHERE clauses and params that pin down one game by date or final score, and teams"""
+    where, params = [], {}
+    if anchor == "date":
+        where.append(f"CAST({alias}.game_timestamp AS date) = :d")
+        params["d"] = slots["date"]
+    elif anchor == "score":
+        where.append(f"GREATEST({alias}.home_points, {alias}.away_points) = :hi")
+        where.append(f"LEAST({alias}.home_points, {alias}.away_points) = :lo")
+        params["hi"], params["lo"] = slots["score"]
+    for i, tid in enumerate(slots["teams"][:2]):
+        where.append(f"(:t{i} IN ({alias}.home_team_id, {alias}.away_team_id))")
+        params[f"t{i}"] = tid
+    return where, params
+
+def scoring_team(slots):
+    """Team whose leading scorer is asked for, or None for the whole game.
+
+    "Who led the Thunder in scoring against the Nuggets" means the first team
+    named; "leading scorer in the Thunder-Nuggets game" means either team.
+    """
+    if len(slots["teams"]) == 1 or re.search(r"\bled\b.*\bscoring\b", slots["text"]):
+        return slots["teams"][0]
+    return None
+
+GAME_COLS = "g.game_id, g.game_timestamp, g.home_team_id, g.away_team_id, g.home_points, g.away_points"
+BOX_COLS = "b.person_id, b.team_id, b.points, b.assists, b.offensive_reb + b.defensive_reb AS rebounds"
+
+
+def plan(slots, intent, anchor):
+    """Parameterized SQL for an intent; returns (sql, params)"""
+    if intent in SEASON_INTENTS:
+        return plan_season(slots, intent)
+    where, params = _game_filters(slots, anchor)
+    if not where:
+        where.append("TRUE")
+    if intent in ("team_points", "game_winner"):
+        sql = f"SELECT {GAME_COLS} FROM game_details g WHERE {' AND '.join(where)} ORDER BY g.game_timestamp LIMIT 1"
+    elif intent == "leading_scorer":
+        tid = scoring_team(slots)
+        if tid is not None:
+            where.append("l.team_id = :tid")
+            params["tid"] = tid
+        sql = (
+            f"SELECT l.top_scorer_id AS person_id, l.team_id, l.top_points AS points, {GAME_COLS} "
+            f"FROM agg_game_leaders l JOIN game_details g ON g.game_id = l.game_id "
+            f"WHERE {' AND '.join(where)} ORDER BY g.game_timestamp, l.top_points DESC LIMIT 1"
+        )
+    elif intent == "triple_double":
+        if slots["players"]:
+            where.append("t.person_id = :pid")
+            params["pid"] = slots["players"][0]
+        sql = (
+            f"SELECT t.person_id, t.team_id, t.points, t.rebounds, t.assists, {GAME_COLS} FROM agg_triple_doubles t "
+            f"JOIN game_details g ON g.game_id = t.game_id "
+            f"WHERE {' AND '.join(where)} ORDER BY t.points DESC LIMIT 1"
+        )
+    else:
+        if intent == "player_points":
+            where.append("b.person_id = :pid")
+            params["pid"] = slots["players"][0]
+        if intent == "player_with_points":
+            where.append("b.points = :pts")
+            params["pts"] = slots["points"]
+        join = ""
+        if intent == "player_points" and anchor is None:
+            # A debut with no date or score: the earliest game here is only the
+            # debut if season_exp puts the player's first season in this data
+            join = "JOIN players pl ON pl.player_id = b.person_id "
+            where.append("g.season = (SELECT MAX(season) FROM game_details) + 1 - pl.season_exp")
+        order = "g.game_timestamp, b.points DESC" if intent == "player_points" else "b.points DESC"
+        sql = (
+            f"SELECT {BOX_COLS}, {GAME_COLS} FROM player_box_scores b "
+            f"JOIN game_details g ON g.game_id = b.game_id {join}"
+            f"WHERE {' AND '.join(where)} ORDER BY {order} LIMIT 1"
+        )
+    return sql, params
+
+
+SEASON_INTENTS = ("team_record", "head_to_head", "season_high", "scoring_leader")
+
+
+def player_season_table(slots):
+    """Per-team-stint rows for team-scoped questions, whole-season totals otherwise"""
+    return "agg_player_season" if slots["teams"] else "agg_player_totals"
+
+
+def plan_season(slots, intent):
+    """Season-level lookups against the agg_* tables; returns (sql, params)"""
+    params = {"season": slots["season"]}
+    if intent == "team_record":
+        params["tid"] = slots["teams"][0]
+        sql = "SELECT * FROM agg_team_records WHERE season = :season AND team_id = :tid"
+    elif intent == "head_to_head":
+        params["tid"], params["oid"] = slots["teams"][:2]
+        sql = "SELECT * FROM agg_head_to_head WHERE season = :season AND team_id = :tid AND opponent_id = :oid"
+    else:
+        where = ["season = :season"]
+        if slots["players"]:
+            where.append("person_id = :pid")
+            params["pid"] = slots["players"][0]
+        if slots["teams"]:
+            where.append("team_id = :tid")
+            params["tid"] = slots["teams"][0]
+        order = "high_points DESC" if intent == "season_high" else "points DESC"
+        sql = f"SELECT * FROM {player_season_table(slots)} WHERE {' AND '.join(where)} ORDER BY {order} LIMIT 1"
+    return sql, params
+
+
+def format_season_answer(parser, slots, intent, row):
+    """format_answer for the season-level intents"""
+    ref = parser.ref
+    season = f"{row['season']}-{(row['season'] + 1) % 100:02d}"
+    if intent == "team_record":
+        team = ref.team(row["team_id"])
+        return {
+            "result": {"wins": int(row["wins"]), "losses": int(row["losses"])},
+            "answer": f"The {team} went {row['wins']}-{row['losses']} in the {season} season.",
+            "evidence": [{"table": "agg_team_records", "id": int(row["team_id"])}],
+        }
+    if intent == "head_to_head":
+        team, opp = ref.team(row["team_id"]), ref.team(row["opponent_id"])
+        return {
+            "result": {"wins": int(row["wins"]), "losses": int(row["losses"])},
+            "answer": f"The {team} went {row['wins']}-{row['losses']} against the {opp} in the {season} season.",
+            "evidence": [{"table": "agg_head_to_head", "id": int(row["team_id"])}],
+        }
+    name = ref.player(row["person_id"])
+    if intent == "season_high":
+        return {
+            "result": {"player_name": name, "points": int(row["high_points"])},
+            "answer": f"{name} scored a season-high {row['high_points']} points in the {season} season.",
+            "evidence": [{"table": "game_details", "id": int(row["high_points_game_id"])}],
+        }
+    return {
+        "result": {"player_name": name, "points": int(row["points"]), "games": int(row["games"])},
+        "answer": f"{name} scored {row['points']} points in {row['games']} games in the {season} season.",
+        "evidence": [{"table": player_season_table(slots), "id": int(row["person_id"])}],
+    }
+
+
+def format_answer(parser, slots, intent, row):
+    """Turn the matched row into {"result", "answer", "evidence"}"""
+    if intent in SEASON_INTENTS:
+        return format_season_answer(parser, slots, intent, row)
+    ref = parser.ref
+    home, away = ref.team(row["home_team_id"]), ref.team(row["away_team_id"])
+    when = str(row["game_timestamp"])[:10]
+    if intent == "team_points":
+        tid = slots["teams"][0]
+        pts = row["home_points"] if tid == row["home_team_id"] else row["away_points"]
+        return {
+            "result": {"points": int(pts)},
+            "answer": f"The {ref.team(tid)} scored {pts} points ({away} at {home}, {when}).",
+            "evidence": [{"table": "game_details", "id": int(row["game_id"])}],
+        }
+    if intent == "game_winner":
+        home_won = row["home_points"] > row["away_points"]
+        winner = home if home_won else away
+        score = f"{max(row['home_points'], row['away_points'])}-{min(row['home_points'], row['away_points'])}"
+        return {
+            "result": {"winner": winner, "score": score},
+            "answer": f"The {winner} won {score} ({away} at {home}, {when}).",
+            "evidence": [{"table": "game_details", "id": int(row["game_id"])}],
+        }
+    name = ref.player(row["person_id"])
+    evidence = [{"table": "player_box_scores", "id": int(row["game_id"])}]
+    if intent == "triple_double":
+        return {
+            "result": {"player_name": name, "points": int(row["points"]),
+                       "rebounds": int(row["rebounds"]), "assists": int(row["assists"])},
+            "answer": (f"{name} recorded a triple-double with {row['points']} points, "
+                       f"{row['rebounds']} rebounds and {row['assists']} assists ({away} at {home}, {when})."),
+            "evidence": evidence,
+        }
+    return {
+        "result": {"player_name": name, "points": int(row["points"])},
+        "answer": f"{name} scored {row['points']} points ({away} at {home}, {when}).",
+        "evidence": evidence,
+    }
+
+
+def prepare(parser, question):
+    """Parse a question into (slots, intent, [(sql, params), ...]) or None.
+
+    Queries are tried in order: pinned by date first, then by final score
+    (questions sometimes get the year wrong but the score right).
+    """
+    slots = parser.parse(question)
+    intent = classify(slots)
+    if intent is None:
+        return None
+    anchors = [a for a in ("date", "score") if slots[a] is not None] or [None]
+    return slots, intent, [plan(slots, intent, a) for a in anchors]
+
+
+def fast_answer(cx, parser, question):
+    """Answer directly from the tables, or None to fall back to RAG"""
+    prepared = prepare(parser, question)
+    if prepared is None:
+        return None
+    slots, intent, queries = prepared
+    for sql, params in queries:
+        row = cx.execute(text(sql), params).mappings().first()
+        if row:
+            return format_answer(parser, slots, intent, row)
+    return None
+
+
+async def afast_answer(cx, parser, question):
+    """Async variant of fast_answer for the API server"""
+    prepared = prepare(parser, question)
+    if prepared is None:
+        return None
+    slots, intent, queries = prepared
+    for sql, params in queries:
+        row = (await cx.execute(text(sql), params)).mappings().first()
+        if row:
+            return format_answer(parser, slots, intent, row)
+    return None
@@ -1,24 +1,287 @@
+import argparse
+import logging
 import os
-import pandas as pd
+import time
+from concurrent.futures import ThreadPoolExecutor
 import sqlalchemy as sa
 from sqlalchemy import text
 from pathlib import Path
 from backend.config import DB_DSN
+from backend.cache import bump_data_version
+from backend.aggregates import refresh_aggregates
+from backend.metrics import ROWS_INGESTED, push_job_metrics, setup_logging, span
+
+log = logging.getLogger(__name__)
 
 TABLES = ["game_details", "player_box_scores", "players", "teams"]
 DATA_DIR = Path(__file__).resolve().parent / "data"
 
-def main():
-    print('Starting Database Ingestion')
-    eng = sa.create_engine(DB_DSN)
+# Explicit column types, in CSV column order
+SCHEMA = {
+    "game_details": """
+        game_id bigint NOT NULL,
+        season integer NOT NULL,
+        game_timestamp timestamp NOT NULL,
+        home_team_id bigint NOT NULL,
+        away_team_id bigint NOT NULL,
+        home_points integer NOT NULL,
+        away_points integer NOT NULL,
+        winning_team_id bigint
+    """,
+    "player_box_scores": """
+        game_id bigint NOT NULL,
+        person_id bigint NOT NULL,
+        team_id bigint NOT NULL,
+        starter boolean NOT NULL,
+        seconds double precision NOT NULL,
+        points integer NOT NULL,
+        fg2_made integer NOT NULL,
+        fg2_attempted integer NOT NULL,
+        fg3_made integer NOT NULL,
+        fg3_attempted integer NOT NULL,
+        ft_attempted integer NOT NULL,
+        ft_made integer NOT NULL,
+        offensive_reb integer NOT NULL,
+        defensive_reb integer NOT NULL,
+        assists integer NOT NULL,
+        steals integer NOT NULL,
+        blocks integer NOT NULL,
+        turnovers integer NOT NULL,
+        defensive_fouls integer NOT NULL,
+        offensive_fouls integer NOT NULL
+    """,
+    "players": """
+        player_id bigint NOT NULL,
+        team_id bigint,
+        first_name text NOT NULL,
+        last_name text NOT NULL,
+        birth_date date,
+        height integer,
+        weight integer,
+        position text,
+        draft_year integer,
+        season_exp integer
+    """,
+    "teams": """
+        team_id bigint NOT NULL,
+        city text NOT NULL,
+        name text NOT NULL,
+        abbreviation text NOT NULL,
+        conference text,
+        division text
+    """,
+}
+
+# Keys and secondary indexes, built after the bulk load (faster than maintaining them during COPY)
+PRIMARY_KEYS = {
+    "game_details": ["game_id"],
+    "player_box_scores": ["game_id", "person_id"],
+    "players": ["player_id"],
+    "teams": ["team_id"],
+}
+INDEXES = {
+    "game_details": [["game_timestamp"], ["home_team_id"], ["away_team_id"]],
+    "player_box_scores": [["person_id"], ["team_id"]],
+    "players": [["team_id"]],
+    "teams": [],
+}
+
+
+def copy_csv(eng, table, path):
+    """Stream one CSV into its table with COPY; returns (rows, bytes, seconds)"""
+    started = time.perf_counter()
+    raw = eng.raw_connection()
+    try:
+        cur = raw.cursor()
+        with span(f"ingest.copy.{table}"), open(path, encoding="utf-8") as f:
+            header = f.readline().strip()
+            cur.copy_expert(f"COPY {table} ({header}) FROM STDIN WITH (FORMAT csv)", f)
+        rows = cur.rowcount
+        raw.commit()
+    finally:
+        raw.close()
+    return rows, os.path.getsize(path), time.perf_counter() - started
+
+
+# Incremental (game-day) ingest: delta CSVs are upserted on the primary keys
+# inside one transaction, so the server keeps reading the previous data until
+# the commit. New rows and rows whose values changed get embedding_hash = NULL,
+# which queues exactly them for `embed.py --pending`; aggregates are rebuilt
+# for the affected games only.
+DELTA_ORDER = ["teams", "players", "game_details", "player_box_scores"]
+EMBEDDED_TABLES = ["game_details", "player_box_scores"]
+# Columns that go into embedding texts; changing them re-queues dependent rows
+NAME_COLUMNS = {"teams": ["city", "name"], "players": ["first_name", "last_name"]}
+
+
+def delta_files(paths):
+    """Map delta CSVs (files, or every *.csv in a directory) to tables by file name.
+
+    A file belongs to the table its name starts with, e.g. game_details.csv or
+    player_box_scores_2024-11-03.csv.
+    """
+    files = {t: [] for t in DELTA_ORDER}
+    for p in map(Path, paths):
+        for f in sorted(p.glob("*.csv")) if p.is_dir() else [p]:
+            table = next((t for t in TABLES if f.stem == t or f.stem.startswith(t + "_")), None)
+            if table is None:
+                raise ValueError(f"{f}: file name must start with one of {', '.join(TABLES)}")
+            files[table].append(f)
+    return files
+
+
+def has_column(cur, table, column):
+    # to_regclass resolves the table through the search path, like the upsert itself
+    cur.execute(
+        "SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s AND NOT attisdropped",
+        (table, column),
+    )
+    return cur.fetchone() is not None
+
+
+def upsert_csv(cur, table, path, queue_embedding):
+    """Upsert one delta CSV through a staging table.
+
+    Returns (keys of inserted or changed rows, ids whose name columns changed).
+    Unchanged rows are left alone; with duplicate keys the last line wins.
+    """
+    keys = PRIMARY_KEYS[table]
+    key_list = ", ".join(keys)
+    cur.execute(f"CREATE TEMP TABLE delta_stage ({SCHEMA[table]}, delta_row bigserial)")
+    with open(path, encoding="utf-8") as f:
+        header = f.readline().strip()
+        cur.copy_expert(f"COPY delta_stage ({header}) FROM STDIN WITH (FORMAT csv)", f)
+    cols = [c.strip() for c in header.split(",")]
+
+    renamed = []
+    names = [c for c in NAME_COLUMNS.get(table, []) if c in cols]
+    if names:
+        cur.execute(
+            f"SELECT s.{keys[0]} FROM delta_stage s JOIN {table} t USING ({key_list}) "
+            f"WHERE ({', '.join('s.' + c for c in names)}) IS DISTINCT FROM ({', '.join('t.' + c for c in names)})"
+        )
+        renamed = [r[0] for r in cur.fetchall()]
+
+    values = [c for c in cols if c not in keys]
+    updates = [f"{c} = EXCLUDED.{c}" for c in values]
+    if queue_embedding:
+        updates.append("embedding_hash = NULL")
+    cur.execute(
+        f"INSERT INTO {table} AS t ({', '.join(cols)}) "
+        f"SELECT DISTINCT ON ({key_list}) {', '.join(cols)} FROM delta_stage ORDER BY {key_list}, delta_row DESC "
+        f"ON CONFLICT ({key_list}) DO UPDATE SET {', '.join(updates)} "
+        f"WHERE ({', '.join('t.' + c for c in values)}) IS DISTINCT FROM ({', '.join('EXCLUDED.' + c for c in values)}) "
+        f"RETURNING {key_list}"
+    )
+    changed = [tuple(r) for r in cur.fetchall()]
+    cur.execute("DROP TABLE delta_stage")
+    return changed, renamed
+
+
+def ingest_delta(eng, paths):
+    """Upsert delta CSVs, re-queue affected embeddings and refresh aggregates in
+    one transaction; returns {table: keys of new or changed rows}"""
+    files = delta_files(paths)
+    changed = {t: [] for t in DELTA_ORDER}
+    renamed = {t: [] for t in NAME_COLUMNS}
+    with eng.begin() as cx:
+        cur = cx.connection.dbapi_connection.cursor()
+        # Before the first embed.py run there are no embedding columns to reset
+        queue = {t: has_column(cur, t, "embedding_hash") for t in EMBEDDED_TABLES}
+        for table in DELTA_ORDER:
+            for path in files[table]:
+                with span(f"ingest.delta.{table}"):
+                    keys, names = upsert_csv(cur, table, path, queue.get(table, False))
+                changed[table].extend(keys)
+                if names:
+                    renamed[table].extend(names)
+                ROWS_INGESTED.labels(table).inc(len(keys))
+                log.info("%s: %d new or changed rows from %s", table, len(keys), path.name)
+
+        # A renamed team or player changes the embedding text of its games and box scores
+        if renamed["teams"] and queue["game_details"]:
+            cur.execute("UPDATE game_details SET embedding_hash = NULL "
+                        "WHERE home_team_id = ANY(%s) OR away_team_id = ANY(%s)", (renamed["teams"], renamed["teams"]))
+        if (renamed["teams"] or renamed["players"]) and queue["player_box_scores"]:
+            cur.execute("UPDATE player_box_scores SET embedding_hash = NULL "
+                        "WHERE team_id = ANY(%s) OR person_id = ANY(%s)", (renamed["teams"], renamed["players"]))
+
+        game_ids = {k[0] for k in changed["game_details"]} | {k[0] for k in changed["player_box_scores"]}
+        if game_ids:
+            with span("ingest.aggregates"):
+                refresh_aggregates(cx, sorted(game_ids))
+            log.info("Refreshed aggregates for %d games", len(game_ids))
+        if any(changed.values()):
+            # Delivered at commit, together with the new rows
+            bump_data_version(cx)
+    return changed
+
+
+def build_keys(eng, table):
+    """Add the primary key and secondary indexes for one table"""
+    with span(f"ingest.keys.{table}"), eng.begin() as cx:
+        cx.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(PRIMARY_KEYS[table])})"))
+        for cols in INDEXES[table]:
+            cx.execute(text(f"CREATE INDEX ON {table} ({', '.join(cols)})"))
+        cx.execute(text(f"ANALYZE {table}"))
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Load the CSVs into Postgres")
+    ap.add_argument("--delta", nargs="+", metavar="PATH",
+                    help="upsert these CSVs (files or directories) instead of reloading every table")
+    ap.add_argument("--embed", action="store_true", help="with --delta, embed the new and changed rows right away")
+    args = ap.parse_args(argv)
+    setup_logging()
+    if args.delta:
+        return main_delta(args.delta, args.embed)
+    log.info('Starting Database Ingestion')
+    started = time.perf_counter()
+    eng = sa.create_engine(DB_DSN, pool_size=len(TABLES))
     with eng.begin() as cx:
         # Ensure pgvector extension is available for the `vector` type used to store embeddings
         cx.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        # pg_trgm provides word_similarity() for the lexical half of hybrid retrieval
+        cx.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         for t in TABLES:
-            path = os.path.join(DATA_DIR, f"{t}.csv")
-            df = pd.read_csv(path)
-            df.to_sql(t, cx, if_exists="replace", index=False, method="multi", chunksize=5000)
-    print('Finished Database Ingestion')
+            cx.execute(text(f"DROP TABLE IF EXISTS {t} CASCADE"))
+            cx.execute(text(f"CREATE TABLE {t} ({SCHEMA[t]})"))
+
+    # Load the four tables in parallel, each on its own connection
+    with ThreadPoolExecutor(max_workers=len(TABLES)) as pool:
+        loads = {t: pool.submit(copy_csv, eng, t, os.path.join(DATA_DIR, f"{t}.csv")) for t in TABLES}
+        total_rows = total_bytes = 0
+        for t, fut in loads.items():
+            rows, size, secs = fut.result()
+            total_rows += rows
+            total_bytes += size
+            ROWS_INGESTED.labels(t).inc(rows)
+            log.info("%s: %d rows in %.2fs (%s rows/sec, %.1f MB/s)", t, rows, secs,
+                     f"{rows / max(secs, 1e-9):,.0f}", size / 1e6 / max(secs, 1e-9))
+        for fut in [pool.submit(build_keys, eng, t) for t in TABLES]:
+            fut.result()
+
+    with span("ingest.aggregates"), eng.begin() as cx:
+        n = refresh_aggregates(cx)
+        log.info("Refreshed aggregates for %d games", n)
+        # Tell running servers to drop cached embeddings/answers
+        bump_data_version(cx)
+    elapsed = time.perf_counter() - started
+    log.info('Finished Database Ingestion: %d rows, %.1f MB in %.2fs (%s rows/sec)',
+             total_rows, total_bytes / 1e6, elapsed, f"{total_rows / elapsed:,.0f}")
+    push_job_metrics("ingest")
+
+
+def main_delta(paths, embed):
+    log.info("Starting incremental ingest of %s", ", ".join(map(str, paths)))
+    started = time.perf_counter()
+    changed = ingest_delta(sa.create_engine(DB_DSN), paths)
+    log.info("Finished incremental ingest in %.2fs: %s", time.perf_counter() - started,
+             ", ".join(f"{t} {len(keys)}" for t, keys in changed.items()))
+    push_job_metrics("ingest")
+    if embed and any(changed.values()):
+        from backend import embed as embed_job  # pulls in pandas and the Ollama client
+        embed_job.main(["--pending"])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import logging
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, push_to_gateway
+from backend.config import LOG_LEVEL, PROMETHEUS_PUSHGATEWAY
+
+# Timing spans and Prometheus metrics shared by the chat server and the
+# ingest/embed jobs. server.py exposes them on GET /metrics; the batch jobs
+# log each span so a run's breakdown shows up in its output, and push their
+# run metrics (JOB_REGISTRIES) to a Pushgateway when PROMETHEUS_PUSHGATEWAY is set.
+
+log = logging.getLogger(__name__)
+
+STAGE_SECONDS = Histogram(
+    "nba_stage_seconds", "Time spent in each pipeline stage", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+REQUESTS = Counter("nba_chat_requests_total", "Chat requests by endpoint and how they were answered",
+                   ["endpoint", "path"])
+ERRORS = Counter("nba_chat_errors_total", "Chat requests that failed", ["endpoint"])
+TOKENS = Counter("nba_llm_tokens_generated_total", "Tokens generated by the LLM")
+# Prompt tokens Ollama evaluated (prefill; fewer when it reuses a cached prompt
+# prefix) and tokens it generated (decode), per generation
+LLM_TOKENS = Histogram("nba_llm_tokens", "Tokens per generation by phase", ["phase"],
+                       buckets=(8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096))
+CACHE_LOOKUPS = Counter("nba_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+EMBED_BATCH_FILL = Histogram("nba_embed_batch_size", "Questions per micro-batched /api/embed call",
+                             buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+ADMISSION_REJECTED = Counter("nba_admission_rejected_total", "Requests refused with 503 by reason",
+                             ["limiter", "reason"])
+LIMITER_ACTIVE = Gauge("nba_limiter_active", "Requests holding a limiter slot", ["limiter"])
+LIMITER_WAITING = Gauge("nba_limiter_waiting", "Requests queued for a limiter slot", ["limiter"])
+BREAKER_OPEN = Gauge("nba_circuit_open", "1 while a circuit breaker is open", ["dependency"])
+CLIENT_DISCONNECTS = Counter("nba_client_disconnects_total", "Requests abandoned by the client mid-answer",
+                             ["endpoint"])
+
+# Batch job metrics live in per-job registries: the jobs have no scrape endpoint
+# and the server never updates them, so each job pushes its own at the end of a run
+JOB_REGISTRIES = {"ingest": CollectorRegistry(), "embed": CollectorRegistry()}
+ROWS_EMBEDDED = Counter("nba_rows_embedded_total", "Rows embedded and written back", ["table"],
+                        registry=JOB_REGISTRIES["embed"])
+EMBED_ROWS_PER_SECOND = Gauge("nba_embed_rows_per_second", "Throughput of the latest embedding run", ["table"],
+                              registry=JOB_REGISTRIES["embed"])
+ROWS_INGESTED = Counter("nba_rows_ingested_total", "Rows loaded by ingest", ["table"],
+                        registry=JOB_REGISTRIES["ingest"])
+JOB_LAST_SUCCESS = {
+    job: Gauge("nba_job_last_success_unixtime", "When the job last finished", registry=registry)
+    for job, registry in JOB_REGISTRIES.items()
+}
+
+
+def setup_logging():
+    """Leveled logging for the server and jobs; LOG_LEVEL picks the threshold"""
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    # httpx logs every Ollama call at INFO
+    logging.getLogger("httpx").setLevel(max(logging.WARNING, logging.getLogger().level))
+
+
+@contextmanager
+def span(stage, timings=None):
+    """Time a block into the stage histogram, and into `timings` (ms) when given"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        if timings is not None:
+            timings[stage] = round(elapsed * 1000, 1)
+        log.debug("%s took %.1f ms", stage, elapsed * 1000)
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def llm_usage(stats, timings=None):
+    """Token counts and prefill/decode time from a finished /api/generate response"""
+    TOKENS.inc(stats.get("eval_count", 0))
+    for phase, count, duration in (("prefill", "prompt_eval_count", "prompt_eval_duration"),
+                                   ("decode", "eval_count", "eval_duration")):
+        if count in stats:
+            LLM_TOKENS.labels(phase).observe(stats[count])
+        if duration in stats:
+            # Ollama reports durations in nanoseconds
+            seconds = stats[duration] / 1e9
+            STAGE_SECONDS.labels(f"llm_{phase}").observe(seconds)
+            if timings is not None:
+                timings[f"llm_{phase}"] = round(seconds * 1000, 1)
+
+
+def push_job_metrics(job):
+    """Push a finished batch job's metrics to the Pushgateway, if one is configured"""
+    if not PROMETHEUS_PUSHGATEWAY:
+        return
+    JOB_LAST_SUCCESS[job].set_to_current_time()
+    try:
+        push_to_gateway(PROMETHEUS_PUSHGATEWAY, job=job, registry=JOB_REGISTRIES[job])
+    except OSError as e:
+        # Metrics are best effort; the job itself succeeded
+        log.warning("Could not push %s metrics to %s: %r", job, PROMETHEUS_PUSHGATEWAY, e)
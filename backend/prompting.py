@@ -0,0 +1,69 @@
+import math
+from backend.config import LLM_NUM_CTX, PROMPT_CONTEXT_TOKENS
+
+# Prompt assembly shared by the chat server and rag.py. The static
+# instructions come first and are identical for every question, so Ollama can
+# reuse their evaluated prefix from the previous request; the retrieved rows
+# and the question follow. Rows are fitted to a token budget in retrieval-score
+# order: full line while it fits, then the row's compact line, then dropped.
+
+# Conservative for stat lines: digits and names split into short tokens
+CHARS_PER_TOKEN = 3
+
+# Answer length and context window per question type. Ollama reloads the model
+# when num_ctx changes, so types share LLM_NUM_CTX unless a profile sets its own.
+PROFILES = {
+    "game": {"num_predict": 40},           # a winner and a score
+    "player": {"num_predict": 60},         # a name and a stat or two
+    "triple_double": {"num_predict": 80},  # a name and three stats
+}
+
+
+def estimate_tokens(text):
+    """Rough token count, without loading the model's tokenizer"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def question_type(question, player):
+    """Profile name for a question; `player` is the caller's player/game routing"""
+    q = question.lower()
+    if "triple-double" in q or "triple double" in q:
+        return "triple_double"
+    return "player" if player else "game"
+
+
+def generation_options(kind):
+    """Ollama options for a question type"""
+    profile = PROFILES[kind]
+    return {"num_predict": profile["num_predict"], "num_ctx": profile.get("num_ctx", LLM_NUM_CTX)}
+
+
+def fit_context(rows, budget):
+    """Context lines for `rows` within `budget` tokens; returns (lines, kept rows).
+
+    Each row is a dict with `score`, `line` and optionally `compact`, a shorter
+    line used once the full one no longer fits. Best-scoring rows go first.
+    """
+    lines, kept, used = [], [], 0
+    for row in sorted(rows, key=lambda r: r.get("score") or 0, reverse=True):
+        for line in filter(None, (row["line"], row.get("compact"))):
+            cost = estimate_tokens(line) + 1  # +1 for the newline
+            if used + cost <= budget:
+                lines.append(line)
+                kept.append(row)
+                used += cost
+                break
+    return lines, kept
+
+
+def fit_prompt(instructions, rows, tail, kind):
+    """Budgeted prompt for a question of type `kind`; returns (prompt, kept rows, options).
+
+    `tail` is the question part that follows the data (question, answer cue).
+    """
+    options = generation_options(kind)
+    fixed = estimate_tokens(instructions) + estimate_tokens(tail) + 8  # headers and blank lines
+    budget = min(PROMPT_CONTEXT_TOKENS, options["num_ctx"] - options["num_predict"] - fixed)
+    lines, kept = fit_context(rows, budget)
+    prompt = f"{instructions}\n\nData:\n" + "\n".join(lines) + f"\n\n{tail}"
+    return prompt, kept, options
@@ -1,176 +1,181 @@
 import os
 import json
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import sqlalchemy as sa
 import pandas as pd
-from sqlalchemy import text
-from backend.config import DB_DSN, EMBED_MODEL, LLM_MODEL
+from backend.config import DB_DSN, EMBED_MODEL, LLM_MODEL, RAG_WORKERS
 from backend.utils import ollama_embed, ollama_generate
+from backend.refdata import get_refdata, get_team_name, get_player_name
+from backend.fastpath import build_parser, fast_answer, retrieval_filters
+from backend.retrieval import retrieve
+from backend.prompting import question_type, fit_prompt
+from backend.metrics import setup_logging
+
+log = logging.getLogger(__name__)
 
 BASE_DIR = os.path.dirname(__file__)
 QUESTIONS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "questions.json"))
 ANSWERS_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "answers.json"))
 TEMPLATE_PATH = os.path.normpath(os.path.join(BASE_DIR, "..", "part1", "answers_template.json"))
 
-def get_team_name(team_id, teams_df):
-    """Get team name from team_id"""
-    team = teams_df[teams_df['team_id'] == team_id]
-    if not team.empty:
-        return f"{team.iloc[0]['city']} {team.iloc[0]['name']}"
-    return f"Team_{team_id}"
-
-def get_player_name(player_id, players_df):
-    """Get player name from player_id"""
-    player = players_df[players_df['player_id'] == player_id]
-    if not player.empty:
-        return f"{player.iloc[0]['first_name']} {player.iloc[0]['last_name']}"
-    return f"Player_{player_id}"
-
 def is_player_question(question):
     """Determine if question is asking about player stats vs game results"""
     player_keywords = ['player', 'scored', 'points', 'assists', 'rebounds', 'leading scorer', 'triple-double']
     return any(keyword.lower() in question.lower() for keyword in player_keywords)
 
-def retrieve_games(cx, qvec, k=5):
+def retrieve_games(cx, qvec, k=5, filters=None, question=None):
     """Retrieve similar games from game_details"""
-    sql = (
-        "SELECT game_id, game_timestamp, home_team_id, away_team_id, home_points, away_points, "
-        "1 - (embedding <=> (:q)::vector) AS score FROM game_details "
-        "WHERE embedding IS NOT NULL ORDER BY embedding <-> (:q)::vector LIMIT :k"
-    )
-    return cx.execute(text(sql), {"q": qvec, "k": k}).mappings().all()
-
-def retrieve_players(cx, qvec, k=10):
-    """Retrieve similar player performances from player_box_scores"""
-    sql = (
-        "SELECT game_id, person_id, team_id, points, assists, offensive_reb, defensive_reb, "
-        "steals, blocks, starter, seconds, "
-        "1 - (embedding <=> (:q)::vector) AS score FROM player_box_scores "
-        "WHERE embedding IS NOT NULL ORDER BY embedding <-> (:q)::vector LIMIT :k"
-    )
-    return cx.execute(text(sql), {"q": qvec, "k": k}).mappings().all()
-
-def build_game_context(rows, teams_df):
-    """Build context from game results with team names"""
-    context_lines = []
+    return retrieve(cx, "game_details", qvec, k, filters, question)
+
+def retrieve_players(cx, qvec, k=10, filters=None, question=None):
+    """Retrieve similar player performances together with their game in one query"""
+    return retrieve(cx, "player_box_scores", qvec, k, filters, question)
+
+def build_game_context(rows, teams):
+    """Context rows (retrieval score, prompt line, evidence) for game results"""
+    context_rows = []
     for r in rows:
-        home_team = get_team_name(r['home_team_id'], teams_df)
-        away_team = get_team_name(r['away_team_id'], teams_df)
+        home_team = get_team_name(r['home_team_id'], teams)
+        away_team = get_team_name(r['away_team_id'], teams)
         date = pd.to_datetime(r['game_timestamp']).strftime('%Y-%m-%d')
-        context_lines.append(
-            f"Game {r['game_id']} on {date}: {away_team} vs {home_team}, "
-            f"Final: {home_team} {r['home_points']}, {away_team} {r['away_points']}"
-        )
-    return "\n".join(context_lines)
-
-def build_player_context(rows, teams_df, players_df, cx):
-    """Build context from player performances with names"""
-    context_lines = []
+        context_rows.append({
+            "score": r['score'],
+            "line": f"Game {r['game_id']} on {date}: {away_team} vs {home_team}, "
+                    f"Final: {home_team} {r['home_points']}, {away_team} {r['away_points']}",
+            "evidence": {"table": "game_details", "id": int(r['game_id'])},
+        })
+    return context_rows
+
+def build_player_context(rows, teams, players):
+    """Context rows (retrieval score, prompt line, compact line, evidence) for player performances"""
+    context_rows = []
     for r in rows:
-        player_name = get_player_name(r['person_id'], players_df)
-        team_name = get_team_name(r['team_id'], teams_df)
+        player_name = get_player_name(r['person_id'], players)
+        team_name = get_team_name(r['team_id'], teams)
         total_reb = r['offensive_reb'] + r['defensive_reb']
+        date = pd.to_datetime(r['game_timestamp']).strftime('%Y-%m-%d')
+        home_team = get_team_name(r['home_team_id'], teams)
+        away_team = get_team_name(r['away_team_id'], teams)
         
-        # Get game info for this performance
-        game_info = cx.execute(text(
-            "SELECT game_timestamp, home_team_id, away_team_id, home_points, away_points "
-            "FROM game_details WHERE game_id = :gid"
-        ), {"gid": r['game_id']}).mappings().first()
-        
-        if game_info:
-            date = pd.to_datetime(game_info['game_timestamp']).strftime('%Y-%m-%d')
-            home_team = get_team_name(game_info['home_team_id'], teams_df)
-            away_team = get_team_name(game_info['away_team_id'], teams_df)
-            
-            context_lines.append(
-                f"Game {r['game_id']} on {date} ({away_team} vs {home_team}): "
-                f"{player_name} ({team_name}) - {r['points']} pts, {r['assists']} ast, "
-                f"{total_reb} reb, {r['steals']} stl, {r['blocks']} blk"
-            )
-    return "\n".join(context_lines)
-
-
-def answer(question, context, question_id, evidence):
-    """Generate answer using enhanced context and proper formatting"""
-    
-    # Enhanced prompt for better JSON formatting
-    prompt = f"""You are an NBA statistics expert. Answer the question using ONLY the provided context.
+        context_rows.append({
+            "score": r['score'],
+            "line": f"Game {r['game_id']} on {date} ({away_team} vs {home_team}): "
+                    f"{player_name} ({team_name}) - {r['points']} pts, {r['assists']} ast, "
+                    f"{total_reb} reb, {r['steals']} stl, {r['blocks']} blk",
+            "compact": f"{date} {player_name} {r['points']}/{r['assists']}/{total_reb}/{r['steals']}/{r['blocks']}",
+            "evidence": {"table": "player_box_score", "id": int(r['game_id'])},
+        })
+    return context_rows
 
-IMPORTANT: Your response must be valid JSON in this exact format based on question ID {question_id}:
 
-For game questions (IDs 1,2,3): {{"points": number}} or {{"winner": "Team Name", "score": "XXX-XXX"}}
-For player questions (IDs 4,5,7,8,9,10): {{"player_name": "First Last", "points": number}}
-For triple-double questions (ID 6): {{"player_name": "First Last", "points": number, "rebounds": number, "assists": number}}
+# Static prompt prefix, identical for every question so Ollama can reuse it;
+# the question ID that picks the answer format comes after the data
+INSTRUCTIONS = """You are an NBA statistics expert. Answer the question using ONLY the provided data.
 
-Context:
-{context}
+IMPORTANT: Your response must be valid JSON in this exact format, chosen by the question ID:
 
-Question: {question}
+For game questions (IDs 1,2,3): {"points": number} or {"winner": "Team Name", "score": "XXX-XXX"}
+For player questions (IDs 4,5,7,8,9,10): {"player_name": "First Last", "points": number}
+For triple-double questions (ID 6): {"player_name": "First Last", "points": number, "rebounds": number, "assists": number}
 
-Answer (JSON only):"""
-    
-    return ollama_generate(LLM_MODEL, prompt)
+Short player lines read: date, name, pts/ast/reb/stl/blk."""
 
 
-if __name__ == "__main__":
+def answer(question, rows, question_id, player):
+    """Generate an answer from a budgeted context; returns (raw answer, rows that made it into the prompt)"""
+    tail = f"Question ID: {question_id}\nQuestion: {question}\n\nAnswer (JSON only):"
+    prompt, kept, options = fit_prompt(INSTRUCTIONS, rows, tail, question_type(question, player))
+    return ollama_generate(LLM_MODEL, prompt, options), kept
+
+
+def answer_question(eng, parser, teams, players, q):
+    """Answer one question from the question file; returns its answers.json entry"""
+    print(f"Processing question {q['id']}: {q['question'][:50]}...")
+    
+    with eng.connect() as cx:
+        # Structured stat questions are answered straight from the tables
+        fast = fast_answer(cx, parser, q["question"])
+    if fast:
+        return {"id": q["id"], "result": {**fast["result"], "evidence": fast["evidence"]}}
+    
+    # Create embedding for question (no connection held while Ollama runs)
+    qvec = ollama_embed(EMBED_MODEL, q["question"])
+    filters = retrieval_filters(parser, q["question"])
+    
+    # Determine if it's a player or game question
+    player = is_player_question(q["question"])
+    with eng.connect() as cx:
+        if player:
+            # Retrieve player performances
+            player_rows = retrieve_players(cx, qvec, 10, filters, q["question"])
+            rows = build_player_context(player_rows, teams, players)
+        else:
+            # Retrieve games
+            game_rows = retrieve_games(cx, qvec, 5, filters, q["question"])
+            rows = build_game_context(game_rows, teams)
+    
+    # Generate answer (no connection held while the model runs)
+    raw_answer, kept = answer(q["question"], rows, q["id"], player)
+    evidence = [r["evidence"] for r in kept[:3]]
+    
+    # Try to parse JSON response, fallback if needed
+    try:
+        # Clean up the response to extract JSON
+        clean_answer = raw_answer.strip()
+        if clean_answer.startswith('```json'):
+            clean_answer = clean_answer.replace('```json', '').replace('```', '')
+        elif clean_answer.startswith('```'):
+            clean_answer = clean_answer.replace('```', '')
+        
+        parsed_answer = json.loads(clean_answer.strip())
+        return {"id": q["id"], "result": {**parsed_answer, "evidence": evidence}}
+    except json.JSONDecodeError:
+        print(f"Warning: Could not parse JSON for question {q['id']}, using raw answer")
+        return {"id": q["id"], "result": {"raw_answer": raw_answer, "evidence": evidence}}
+
+
+def safe_answer_question(eng, parser, teams, players, q):
+    """answer_question, with a failure recorded as that question's entry instead of ending the run"""
+    try:
+        return answer_question(eng, parser, teams, players, q)
+    except Exception as e:
+        log.exception("question %s failed", q["id"])
+        return {"id": q["id"], "error": str(e)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Answer a question file with the RAG pipeline")
+    ap.add_argument("--questions", default=QUESTIONS_PATH, help="questions JSON file")
+    ap.add_argument("--output", default=ANSWERS_PATH, help="where to write the answers JSON")
+    ap.add_argument("--workers", type=int, default=RAG_WORKERS, help="questions processed concurrently")
+    args = ap.parse_args(argv)
+    setup_logging()
+    
     print("Starting Enhanced RAG Pipeline...")
-    eng = sa.create_engine(DB_DSN)
+    eng = sa.create_engine(DB_DSN, pool_size=args.workers, max_overflow=0)
     
-    # Load reference data
-    teams_df = pd.read_sql("SELECT team_id, city, name, abbreviation FROM teams", eng)
-    players_df = pd.read_sql("SELECT player_id, first_name, last_name FROM players", eng)
+    # Load reference data once; every worker shares it
+    ref = get_refdata(eng)
+    teams, players = ref.teams, ref.players
+    parser = build_parser(ref)
     
-    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+    with open(args.questions, encoding="utf-8") as f:
         qs = json.load(f)
     
-    results = []
-    
-    with eng.begin() as cx:
-        for i, q in enumerate(qs):
-            print(f"Processing question {q['id']}: {q['question'][:50]}...")
-            
-            # Create embedding for question
-            qvec = ollama_embed(EMBED_MODEL, q["question"])
-            
-            # Determine if it's a player or game question
-            if is_player_question(q["question"]):
-                # Retrieve player performances
-                player_rows = retrieve_players(cx, qvec, 10)
-                context = build_player_context(player_rows, teams_df, players_df, cx)
-                evidence = [{"table": "player_box_score", "id": int(r["game_id"])} for r in player_rows[:3]]
-            else:
-                # Retrieve games
-                game_rows = retrieve_games(cx, qvec, 5)
-                context = build_game_context(game_rows, teams_df)
-                evidence = [{"table": "game_details", "id": int(r["game_id"])} for r in game_rows[:3]]
-            
-            # Generate answer
-            raw_answer = answer(q["question"], context, q["id"], evidence)
-            
-            # Try to parse JSON response, fallback if needed
-            try:
-                # Clean up the response to extract JSON
-                clean_answer = raw_answer.strip()
-                if clean_answer.startswith('```json'):
-                    clean_answer = clean_answer.replace('```json', '').replace('```', '')
-                elif clean_answer.startswith('```'):
-                    clean_answer = clean_answer.replace('```', '')
-                
-                parsed_answer = json.loads(clean_answer.strip())
-                
-                results.append({
-                    "id": q["id"],
-                    "result": {**parsed_answer, "evidence": evidence}
-                })
-            except json.JSONDecodeError:
-                print(f"Warning: Could not parse JSON for question {q['id']}, using raw answer")
-                results.append({
-                    "id": q["id"],
-                    "result": {"raw_answer": raw_answer, "evidence": evidence}
-                })
+    # pool.map yields in submission order, so answers stay in question order
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(lambda q: safe_answer_question(eng, parser, teams, players, q), qs))
     
     # Save results
-    with open(ANSWERS_PATH, "w", encoding="utf-8") as f:
+    with open(args.output, "w", encoding="utf-8") as f:
         json.dump(results, f, ensure_ascii=False, indent=2)
     
-    print(f"Completed! Generated answers for {len(results)} questions.")
-    print(f"Results saved to: {ANSWERS_PATH}")
+    failed = sum("error" in r for r in results)
+    print(f"Completed! Generated answers for {len(results) - failed} questions ({failed} failed).")
+    print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+from sqlalchemy import text
+
+# Reference data (teams, players) as plain id -> name dicts so lookups are O(1).
+# The tables are tiny and only change on ingest, so each process keeps one
+# RefData in memory and resolves names from it instead of joining them in SQL;
+# the server drops it when the data version changes (see server.py).
+
+TEAMS_SQL = "SELECT team_id, city, name, abbreviation FROM teams"
+PLAYERS_SQL = "SELECT player_id, first_name, last_name FROM players"
+
+
+class RefData:
+    """Teams and players held in memory: the rows plus id -> name maps"""
+
+    def __init__(self, team_rows, player_rows):
+        self.team_rows = [dict(r) for r in team_rows]
+        self.player_rows = [dict(r) for r in player_rows]
+        self.teams = {int(r["team_id"]): f"{r['city']} {r['name']}" for r in self.team_rows}
+        self.players = {int(r["player_id"]): f"{r['first_name']} {r['last_name']}" for r in self.player_rows}
+
+    def team(self, team_id):
+        return get_team_name(team_id, self.teams)
+
+    def player(self, player_id):
+        return get_player_name(player_id, self.players)
+
+
+# The process-wide instance, loaded on first use
+_current = None
+
+
+def load_refdata(cx):
+    """Read teams and players over a connection"""
+    return RefData(cx.execute(text(TEAMS_SQL)).mappings().all(), cx.execute(text(PLAYERS_SQL)).mappings().all())
+
+
+async def aload_refdata(cx):
+    """Async variant of load_refdata"""
+    teams = (await cx.execute(text(TEAMS_SQL))).mappings().all()
+    players = (await cx.execute(text(PLAYERS_SQL))).mappings().all()
+    return RefData(teams, players)
+
+
+def get_refdata(eng):
+    """The shared RefData, read from the database the first time"""
+    global _current
+    if _current is None:
+        with eng.connect() as cx:
+            _current = load_refdata(cx)
+    return _current
+
+
+async def aget_refdata(eng):
+    """Async variant of get_refdata for the API server"""
+    global _current
+    if _current is None:
+        async with eng.connect() as cx:
+            _current = await aload_refdata(cx)
+    return _current
+
+
+def invalidate_refdata():
+    """Forget the shared RefData so the next get_refdata reads it again"""
+    global _current
+    _current = None
+
+
+def team_names(teams_df):
+    """Build a team_id -> "City Name" map"""
+    return dict(zip(teams_df["team_id"].astype(int), teams_df["city"] + " " + teams_df["name"]))
+
+def player_names(players_df):
+    """Build a player_id -> "First Last" map"""
+    return dict(zip(players_df["player_id"].astype(int), players_df["first_name"] + " " + players_df["last_name"]))
+
+def load_names(eng):
+    """Return (team_names, player_names) from the shared RefData"""
+    ref = get_refdata(eng)
+    return ref.teams, ref.players
+
+def get_team_name(team_id, teams):
+    """Get team name from team_id"""
+    return teams.get(int(team_id), f"Team_{team_id}")
+
+def get_player_name(player_id, players):
+    """Get player name from player_id"""
+    return players.get(int(player_id), f"Player_{player_id}")
+
+def map_team_names(ids, teams):
+    """Vectorized get_team_name over a Series of team ids"""
+    return ids.map(teams).fillna("Team_" + ids.astype(str))
+
+def map_player_names(ids, players):
+    """Vectorized get_player_name over a Series of player ids"""
+    return ids.map(players).fillna("Player_" + ids.astype(str))
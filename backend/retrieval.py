@@ -0,0 +1,240 @@
+import sys
+from datetime import datetime, time
+import sqlalchemy as sa
+from sqlalchemy import text
+from backend.config import (
+    DB_DSN, HNSW_EF_SEARCH, RETRIEVAL_BACKEND, HYBRID_K, RRF_K,
+    EMBED_STORAGE, EMBED_BINARY_INDEX, BINARY_RERANK_FACTOR,
+)
+from backend.utils import vector_literal
+
+# Retrieval SQL shared by server.py and rag.py. Similarity search always runs
+# first as a bare top-k over the embedding table, written so the planner can
+# use the HNSW (cosine ops) index: cosine distance operator, a NOT NULL filter
+# and nothing but ORDER BY ... LIMIT. Only those k rows are then joined to
+# their games. Rows carry team and player ids only; callers resolve names from
+# the in-memory reference data (refdata.py). The query vector is cast to the
+# stored type (EMBED_STORAGE); comparing across types would bypass the index.
+VTYPE = EMBED_STORAGE
+
+GAME_TOPK = (
+    f"SELECT game_id, 1 - (embedding <=> CAST(:q AS {VTYPE})) AS score FROM game_details "
+    f"WHERE embedding IS NOT NULL ORDER BY embedding <=> CAST(:q AS {VTYPE}) LIMIT :k"
+)
+PLAYER_TOPK = (
+    f"SELECT game_id, person_id, 1 - (embedding <=> CAST(:q AS {VTYPE})) AS score FROM player_box_scores "
+    f"WHERE embedding IS NOT NULL ORDER BY embedding <=> CAST(:q AS {VTYPE}) LIMIT :k"
+)
+# With EMBED_BINARY_INDEX: a Hamming-distance pass over the binary-quantized
+# index picks :cand candidates, which are re-ranked on the stored embedding
+BQ_ORDER = f"binary_quantize(embedding)::bit(768) <~> binary_quantize(CAST(:q AS {VTYPE}))::bit(768)"
+GAME_TOPK_BQ = (
+    f"SELECT game_id, 1 - (embedding <=> CAST(:q AS {VTYPE})) AS score FROM ("
+    f"  SELECT game_id, embedding FROM game_details WHERE embedding IS NOT NULL ORDER BY {BQ_ORDER} LIMIT :cand"
+    f") c ORDER BY embedding <=> CAST(:q AS {VTYPE}) LIMIT :k"
+)
+PLAYER_TOPK_BQ = (
+    f"SELECT game_id, person_id, 1 - (embedding <=> CAST(:q AS {VTYPE})) AS score FROM ("
+    f"  SELECT game_id, person_id, embedding FROM player_box_scores WHERE embedding IS NOT NULL "
+    f"  ORDER BY {BQ_ORDER} LIMIT :cand"
+    f") c ORDER BY embedding <=> CAST(:q AS {VTYPE}) LIMIT :k"
+)
+# Same shape of hits when the top-k comes from the local snapshot (vindex.py)
+GAME_HITS = "SELECT * FROM unnest(CAST(:gids AS bigint[]), CAST(:scores AS float8[])) AS h(game_id, score)"
+PLAYER_HITS = (
+    "SELECT * FROM unnest(CAST(:gids AS bigint[]), CAST(:pids AS bigint[]), CAST(:scores AS float8[])) "
+    "AS h(game_id, person_id, score)"
+)
+
+GAME_JOIN = (
+    "WITH hits AS MATERIALIZED ({hits}) "
+    "SELECT g.game_id, g.game_timestamp, g.home_team_id, g.away_team_id, g.home_points, g.away_points, hits.score "
+    "FROM hits "
+    "JOIN game_details g ON g.game_id = hits.game_id "
+    "ORDER BY hits.score DESC"
+)
+PLAYER_JOIN = (
+    "WITH hits AS MATERIALIZED ({hits}) "
+    "SELECT p.game_id, p.person_id, p.team_id, p.points, p.assists, p.offensive_reb, p.defensive_reb, "
+    "p.offensive_reb + p.defensive_reb AS rebounds, p.steals, p.blocks, p.starter, p.seconds, "
+    "g.game_timestamp, g.home_team_id, g.away_team_id, g.home_points, g.away_points, hits.score "
+    "FROM hits "
+    "JOIN player_box_scores p ON p.game_id = hits.game_id AND p.person_id = hits.person_id "
+    "JOIN game_details g ON g.game_id = p.game_id "
+    "ORDER BY hits.score DESC"
+)
+
+# Hybrid search, used when the question names a date, season, team or player
+# (fastpath.retrieval_filters). Those filters cut the candidates down before
+# any vector math, then the exact vector ranking and a trigram ranking over
+# team/player names are fused with reciprocal rank fusion.
+GAME_HYBRID = (
+    "WITH cand AS MATERIALIZED ("
+    "  SELECT g.game_id, g.embedding, "
+    "         word_similarity(ht.city || ' ' || ht.name, :qt) + word_similarity(at.city || ' ' || at.name, :qt) AS lex "
+    "  FROM game_details g "
+    "  JOIN teams ht ON ht.team_id = g.home_team_id "
+    "  JOIN teams at ON at.team_id = g.away_team_id "
+    "  WHERE g.embedding IS NOT NULL {filters}"
+    "), ranked AS ("
+    "  SELECT game_id, "
+    f"         row_number() OVER (ORDER BY embedding <=> CAST(:q AS {VTYPE})) AS vr, "
+    "         row_number() OVER (ORDER BY lex DESC) AS lr "
+    "  FROM cand"
+    ") "
+    "SELECT game_id, 1.0 / (:rrf + vr) + 1.0 / (:rrf + lr) AS score FROM ranked ORDER BY score DESC LIMIT :k"
+)
+PLAYER_HYBRID = (
+    "WITH cand AS MATERIALIZED ("
+    "  SELECT p.game_id, p.person_id, p.embedding, "
+    "         word_similarity(pl.first_name || ' ' || pl.last_name, :qt) "
+    "         + word_similarity(t.city || ' ' || t.name, :qt) AS lex "
+    "  FROM player_box_scores p "
+    "  JOIN game_details g ON g.game_id = p.game_id "
+    "  JOIN players pl ON pl.player_id = p.person_id "
+    "  JOIN teams t ON t.team_id = p.team_id "
+    "  WHERE p.embedding IS NOT NULL {filters}"
+    "), ranked AS ("
+    "  SELECT game_id, person_id, "
+    f"         row_number() OVER (ORDER BY embedding <=> CAST(:q AS {VTYPE})) AS vr, "
+    "         row_number() OVER (ORDER BY lex DESC) AS lr "
+    "  FROM cand"
+    ") "
+    "SELECT game_id, person_id, 1.0 / (:rrf + vr) + 1.0 / (:rrf + lr) AS score "
+    "FROM ranked ORDER BY score DESC LIMIT :k"
+)
+
+
+def filter_sql(table, filters):
+    """SQL conditions and params for hybrid metadata filters (game alias g, box score alias p)"""
+    where, params = [], {}
+    if filters.get("date_from") is not None:
+        where.append("g.game_timestamp >= :date_from AND g.game_timestamp < :date_to")
+        # game_timestamp is a timestamp column, and asyncpg wants datetimes for it
+        params["date_from"] = datetime.combine(filters["date_from"], time.min)
+        params["date_to"] = datetime.combine(filters["date_to"], time.min)
+    for i, tid in enumerate(filters.get("teams", [])):
+        where.append(f":team{i} IN (g.home_team_id, g.away_team_id)")
+        params[f"team{i}"] = tid
+    if filters.get("players"):
+        if table == "player_box_scores":
+            where.append("p.person_id = ANY(CAST(:player_ids AS bigint[]))")
+        else:
+            where.append(
+                "g.game_id IN (SELECT game_id FROM player_box_scores "
+                "WHERE person_id = ANY(CAST(:player_ids AS bigint[])))"
+            )
+        params["player_ids"] = list(filters["players"])
+    return "".join(f" AND {w}" for w in where), params
+
+
+def build_hybrid_query(table, qvec, k, filters, question):
+    """Filtered, rank-fused top-k joined the same way as build_query"""
+    conditions, params = filter_sql(table, filters)
+    if table == "game_details":
+        sql = GAME_JOIN.format(hits=GAME_HYBRID.format(filters=conditions))
+    else:
+        sql = PLAYER_JOIN.format(hits=PLAYER_HYBRID.format(filters=conditions))
+    params.update({"q": vector_literal(qvec), "qt": question, "k": min(k, HYBRID_K), "rrf": RRF_K})
+    return text(sql), params
+
+
+# Built once so SQLAlchemy's compiled cache (and asyncpg's prepared statement
+# cache on the server) reuse the same statements across requests
+SET_EF_SEARCH = text("SELECT set_config('hnsw.ef_search', :ef, true)")
+TOPK = {
+    "game_details": GAME_TOPK_BQ if EMBED_BINARY_INDEX else GAME_TOPK,
+    "player_box_scores": PLAYER_TOPK_BQ if EMBED_BINARY_INDEX else PLAYER_TOPK,
+}
+QUERIES = {
+    ("game_details", "pgvector"): text(GAME_JOIN.format(hits=TOPK["game_details"])),
+    ("game_details", "local"): text(GAME_JOIN.format(hits=GAME_HITS)),
+    ("player_box_scores", "pgvector"): text(PLAYER_JOIN.format(hits=TOPK["player_box_scores"])),
+    ("player_box_scores", "local"): text(PLAYER_JOIN.format(hits=PLAYER_HITS)),
+}
+
+
+def build_query(table, qvec, k):
+    """Pick the statement and parameters for the configured backend"""
+    if RETRIEVAL_BACKEND == "local":
+        from backend.vindex import get_index  # only the local backend needs the snapshot reader
+        hits = get_index(table).search(qvec, k)
+        params = {"gids": [key[0] for key, _ in hits], "scores": [score for _, score in hits]}
+        if table == "player_box_scores":
+            params["pids"] = [key[1] for key, _ in hits]
+        return QUERIES[(table, "local")], params
+    params = {"q": vector_literal(qvec), "k": k}
+    if EMBED_BINARY_INDEX:
+        params["cand"] = candidates(k)
+    return QUERIES[(table, "pgvector")], params
+
+
+def candidates(k):
+    """Rows taken from the binary index for re-ranking"""
+    return k * BINARY_RERANK_FACTOR
+
+
+def ef_search(k):
+    """hnsw.ef_search for a query; must be at least the number of rows the index returns"""
+    return str(max(HNSW_EF_SEARCH, candidates(k) if EMBED_BINARY_INDEX else k))
+
+
+def retrieve(cx, table, qvec, k, filters=None, question=None):
+    """Top-k rows of `table` most similar to qvec, joined with game info (ids, no names).
+
+    With filters (and the question text for lexical matching) this runs the
+    hybrid search instead, which needs no index and returns at most HYBRID_K rows.
+    """
+    if filters:
+        sql, params = build_hybrid_query(table, qvec, k, filters, question)
+        rows = cx.execute(sql, params).mappings().all()
+        if rows:
+            return rows
+    sql, params = build_query(table, qvec, k)
+    if RETRIEVAL_BACKEND != "local":
+        # Transaction-local, so pooled connections don't carry it over
+        cx.execute(SET_EF_SEARCH, {"ef": ef_search(k)})
+    return cx.execute(sql, params).mappings().all()
+
+
+async def aretrieve(cx, table, qvec, k, filters=None, question=None):
+    """Async variant of retrieve for the API server"""
+    if filters:
+        sql, params = build_hybrid_query(table, qvec, k, filters, question)
+        rows = (await cx.execute(sql, params)).mappings().all()
+        if rows:
+            return rows
+    sql, params = build_query(table, qvec, k)
+    if RETRIEVAL_BACKEND != "local":
+        await cx.execute(SET_EF_SEARCH, {"ef": ef_search(k)})
+    return (await cx.execute(sql, params)).mappings().all()
+
+
+def topk_index(table):
+    """Name of the index the top-k query for a table should be served by"""
+    return f"idx_{table}_embedding_bq" if EMBED_BINARY_INDEX else f"idx_{table}_embedding"
+
+
+def explain_topk(cx, table):
+    """EXPLAIN the top-k query for a table with a stored embedding as the probe"""
+    probe = cx.execute(text(f"SELECT embedding::text FROM {table} WHERE embedding IS NOT NULL LIMIT 1")).scalar()
+    if probe is None:
+        raise RuntimeError(f"{table} has no embeddings yet; run backend/embed.py first")
+    plan = cx.execute(text("EXPLAIN " + TOPK[table]), {"q": probe, "k": 10, "cand": candidates(10)}).scalars().all()
+    return "\n".join(plan)
+
+
+if __name__ == "__main__":
+    # Check that both top-k queries are served by their HNSW index:
+    #   python -m backend.retrieval
+    eng = sa.create_engine(DB_DSN)
+    ok = True
+    with eng.connect() as cx:
+        for table in ("game_details", "player_box_scores"):
+            plan = explain_topk(cx, table)
+            index = topk_index(table)
+            used = index in plan
+            ok = ok and used
+            print(f"{table}: {'uses' if used else 'DOES NOT use'} {index}")
+            print("  " + plan.replace("\n", "\n  "))
+    sys.exit(0 if ok else 1)
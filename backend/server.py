@@ -1,12 +1,68 @@
-from fastapi import FastAPI
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from pydantic import BaseModel
-import sqlalchemy as sa
-from backend.config import DB_DSN, EMBED_MODEL, LLM_MODEL
-from backend.utils import ollama_embed, ollama_generate
+from sqlalchemy.ext.asyncio import create_async_engine
+from backend.config import (
+    ASYNC_DB_DSN, EMBED_MODEL, LLM_MODEL,
+    QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SEMANTIC_THRESHOLD, CACHE_VERSION_CHECK_SECONDS, WARMUP_RETRY_SECONDS,
+    GENERATE_CONCURRENCY, GENERATE_QUEUE_LIMIT, GENERATE_QUEUE_TIMEOUT, EMBED_TIMEOUT, RETRIEVE_TIMEOUT,
+)
+from backend.admission import Limiter, Overloaded, ClientDisconnected, cancel_on_disconnect
+from backend.cache import TTLCache, AnswerCache, normalize_question, DATA_VERSION_CHANNEL
+from backend.fastpath import build_parser, afast_answer, retrieval_filters
+from backend.refdata import aget_refdata, invalidate_refdata
+from backend.prompting import question_type, fit_prompt
+from backend.metrics import REQUESTS, ERRORS, CLIENT_DISCONNECTS, ADMISSION_REJECTED, setup_logging, span, cache_lookup
+from backend.retrieval import aretrieve
+from backend.utils import (
+    EmbedBatcher, ollama_breaker, aollama_load, aollama_generate, aollama_generate_stream, close_async_client,
+)
 from sqlalchemy import text
 
-app = FastAPI()
+setup_logging()
+log = logging.getLogger(__name__)
+
+POOL_SIZE = 10
+# Async pool shared by all requests; connections are only held during retrieval.
+# Created in lifespan() so importing this module (and forking workers) stays cheap.
+eng = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global eng
+    eng = create_async_engine(ASYNC_DB_DSN, pool_size=POOL_SIZE, max_overflow=10, pool_pre_ping=True)
+    # Warm up in the background: the server accepts requests right away and
+    # /api/health turns ready once the pool, models and index pages are hot
+    task = asyncio.create_task(warm_up())
+    listener = asyncio.create_task(listen_for_data_changes())
+    yield
+    task.cancel()
+    listener.cancel()
+    await close_async_client()
+    await eng.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request, exc):
+    """Saturated or Ollama unavailable: fail fast and tell the client when to come back"""
+    log.warning("Refusing %s: %s", request.url.path, exc.reason)
+    return JSONResponse(
+        {"answer": "The server is busy, please try again shortly.", "evidence": [], "retry_after": exc.retry_after},
+        status_code=503, headers={"Retry-After": str(exc.retry_after)},
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:4200"],
@@ -15,140 +71,426 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-eng = sa.create_engine(DB_DSN)
+# Normalized question -> embedding, and (question, evidence, model) -> answer
+question_cache = TTLCache(QUESTION_CACHE_SIZE, QUESTION_CACHE_TTL)
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SEMANTIC_THRESHOLD)
+# Concurrent question embeddings share /api/embed calls
+embedder = EmbedBatcher(EMBED_MODEL)
+# Generation slots; requests beyond the queue limit get an immediate 503
+generate_limiter = Limiter("generate", GENERATE_CONCURRENCY, GENERATE_QUEUE_LIMIT, GENERATE_QUEUE_TIMEOUT)
+_data_version = None
+_version_checked_at = 0.0
+# Slot parser for the deterministic SQL fast path, built from the in-memory
+# teams/players (refdata.py) on first use
+_parser = None
+# Startup warm-up progress, reported by /api/health
+_warmup = {"ready": False, "steps": {}, "error": None}
 
 class Q(BaseModel):
     question: str
+    # Include a per-stage timing breakdown (ms) in the response
+    timings: bool = False
 
-@app.post("/api/chat")
-def answer(q: Q):
-    print(f'Received question: {q.question}')
-    
+# Phrases that route a question to player box scores instead of game results
+PLAYER_INDICATORS = [
+    'leading scorer', 'triple-double', 'recorded a triple',
+    'points did', 'scored', 'rebounds did', 'assists did',
+    'performance', 'stats', 'statistics', 'how many points',
+    'player had', 'player scored', 'player recorded'
+]
+
+def needs_player_data(question):
+    """Smart query routing - check if question needs player data"""
+    question_lower = question.lower()
+    return any(indicator in question_lower for indicator in PLAYER_INDICATORS)
+
+
+async def check_data_version(force=False):
+    """Drop the caches and reference data once ingest/embed has bumped the data version"""
+    global _data_version, _version_checked_at, _parser
+    now = time.monotonic()
+    if not force and now - _version_checked_at < CACHE_VERSION_CHECK_SECONDS:
+        return
+    _version_checked_at = now
     try:
-        # Step 1: Generate embedding for the question using Ollama
-        print("Generating question embedding...")
-        qvec = ollama_embed(EMBED_MODEL, q.question)
-        print(f"Generated embedding with {len(qvec)} dimensions")
-        
-        with eng.begin() as cx:
-            # Step 2: Semantic retrieval using pgvector
-            print("Performing semantic retrieval...")
-            
-            # Smart query routing - check if question needs player data
-            question_lower = q.question.lower()
-            
-            # Default to game data (safer approach)
-            needs_player_data = False
-            
-            # Check for player-specific questions
-            player_indicators = [
-                'leading scorer', 'triple-double', 'recorded a triple',
-                'points did', 'scored', 'rebounds did', 'assists did',
-                'performance', 'stats', 'statistics', 'how many points',
-                'player had', 'player scored', 'player recorded'
-            ]
-            
-            # Also check if question mentions specific player names or individual stats
-            if any(indicator in question_lower for indicator in player_indicators):
-                needs_player_data = True
-            
-            print(f"Question routing: {'PLAYER' if needs_player_data else 'GAME'} search for: {q.question[:50]}...")
-            
-            if needs_player_data:
+        async with eng.connect() as cx:
+            version = (await cx.execute(text("SELECT version FROM data_version WHERE id = 1"))).scalar()
+    except Exception:
+        version = None  # data_version not created yet
+    if version != _data_version:
+        if _data_version is not None:
+            log.info("Data version changed (%s -> %s), clearing caches", _data_version, version)
+        question_cache.clear()
+        answer_cache.clear()
+        invalidate_refdata()
+        _parser = None
+        _data_version = version
+
+
+async def listen_for_data_changes():
+    """Re-check the data version as soon as ingest/embed NOTIFY a bump.
+
+    Holds one pooled connection for LISTEN and reconnects when it drops; the
+    periodic check in check_data_version covers anything missed meanwhile.
+    """
+    while True:
+        try:
+            async with eng.connect() as cx:
+                conn = (await cx.get_raw_connection()).driver_connection
+                changed = asyncio.Event()
+                await conn.add_listener(DATA_VERSION_CHANNEL, lambda *args: changed.set())
+                conn.add_termination_listener(lambda *args: changed.set())
+                while not conn.is_closed():
+                    await changed.wait()
+                    changed.clear()
+                    await check_data_version(force=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.warning("Data change listener failed (%r), retrying in %gs", e, WARMUP_RETRY_SECONDS)
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+
+async def get_refdata():
+    """Teams and players in memory (refdata.py), reloaded after a data change"""
+    return await aget_refdata(eng)
+
+
+async def get_parser():
+    """Slot parser for the fast path and retrieval filters, built on first use"""
+    global _parser
+    if _parser is None:
+        _parser = build_parser(await get_refdata())
+    return _parser
+
+
+async def try_fast_path(question, timings=None):
+    """Exact answer from SQL templates, or None to fall back to RAG"""
+    parser = await get_parser()
+    with span("fast_path", timings):
+        async with eng.connect() as cx:
+            return await afast_answer(cx, parser, question)
+
+
+async def embed_question(question, timings=None):
+    """Question embedding, served from the cache when possible"""
+    key = normalize_question(question)
+    qvec = question_cache.get(key)
+    cache_lookup("question", qvec is not None)
+    if qvec is None:
+        with span("embed", timings):
+            qvec = await asyncio.wait_for(embedder.embed(question), EMBED_TIMEOUT)
+        question_cache.put(key, qvec)
+    return qvec
+
+
+async def retrieve_context(question, qvec, player_question, timings=None):
+    """Semantic retrieval (see retrieval.py); returns prompt context rows"""
+    log.debug("Question routing: %s search for: %s", "PLAYER" if player_question else "GAME", question[:50])
+    # Dates, teams and players named in the question narrow the search first
+    filters = retrieval_filters(await get_parser(), question)
+
+    with span("retrieve", timings):
+        async with asyncio.timeout(RETRIEVE_TIMEOUT), eng.connect() as cx:
+            if player_question:
                 # Use semantic search for player data
-                print("Using semantic search for player data...")
-                player_rows = cx.execute(
-                    text(
-                        "SELECT p.game_id, p.person_id, p.points, p.offensive_reb + p.defensive_reb as rebounds, "
-                        "p.assists, pl.first_name, pl.last_name, g.game_timestamp, "
-                        "ht.name as home_team, at.name as away_team "
-                        "FROM player_box_scores p "
-                        "JOIN players pl ON p.person_id = pl.player_id "
-                        "JOIN game_details g ON p.game_id = g.game_id "
-                        "JOIN teams ht ON g.home_team_id = ht.team_id "
-                        "JOIN teams at ON g.away_team_id = at.team_id "
-                        "ORDER BY p.embedding <-> CAST(:q AS vector) LIMIT :k"
-                    ),
-                    {"q": qvec, "k": 5},  
-                ).fetchall()
+                player_rows = await aretrieve(cx, "player_box_scores", qvec, 5, filters, question)
                 combined_rows = []  # Use player data instead
             else:
                 # Get game data for team/score questions
-                combined_rows = cx.execute(
-                    text(
-                        "SELECT g.game_id, g.game_timestamp, g.home_team_id, g.away_team_id, "
-                        "g.home_points, g.away_points, ht.name as home_team, at.name as away_team "
-                        "FROM game_details g "
-                        "JOIN teams ht ON g.home_team_id = ht.team_id "
-                        "JOIN teams at ON g.away_team_id = at.team_id "
-                        "ORDER BY g.embedding <-> CAST(:q AS vector) LIMIT :k"
-                    ),
-                    {"q": qvec, "k": 1},  
-                ).fetchall()
-                player_rows = []  
-            
-            print(f"Found {len(combined_rows)} games and {len(player_rows)} players")
-            
-            # Step 3: Build context from retrieved data
-            context = ""
-            evidence = []
-            
-            # Add game data if available (simplified for speed)
-            if combined_rows:
-                for row in combined_rows:
-                    game_id = int(row.game_id)
-                    home_points = int(row.home_points) if row.home_points else 0
-                    away_points = int(row.away_points) if row.away_points else 0
-                    home_team = str(row.home_team) if row.home_team else ""
-                    away_team = str(row.away_team) if row.away_team else ""
-                    timestamp = str(row.game_timestamp) if row.game_timestamp else ""
-                    
-                    # Clean date format - only show YYYY-MM-DD
-                    date = timestamp[:10] if timestamp else ""
-                    context += f"{away_team} {away_points}-{home_points} {home_team} {date}\n"
-                    evidence.append({"table": "game_details", "id": game_id})
-            
-            # Add player data if available (simplified for speed)
-            if player_rows:
-                for row in player_rows:
-                    game_id = int(row.game_id) if row.game_id else 0
-                    points = int(row.points) if row.points else 0
-                    rebounds = int(row.rebounds) if row.rebounds else 0
-                    assists = int(row.assists) if row.assists else 0
-                    first_name = str(row.first_name) if row.first_name else ""
-                    last_name = str(row.last_name) if row.last_name else ""
-                    timestamp = str(row.game_timestamp) if row.game_timestamp else ""
-                    
-                    # Clean date format - only show YYYY-MM-DD
-                    date = timestamp[:10] if timestamp else ""
-                    context += f"{first_name} {last_name}: {points} points, {rebounds} rebounds, {assists} assists {date}\n"
-                    evidence.append({"table": "player_box_scores", "id": game_id})
+                combined_rows = await aretrieve(cx, "game_details", qvec, 1, filters, question)
+                player_rows = []
+
+    log.debug("Found %d games and %d players", len(combined_rows), len(player_rows))
+    return build_context(combined_rows, player_rows, await get_refdata())
+
+
+def build_context(combined_rows, player_rows, ref):
+    """Context rows (retrieval score, prompt line, compact line, evidence) for the retrieved rows.
+
+    Retrieval returns ids only; team and player names come from `ref`.
+    """
+    rows = []
+
+    # Add game data if available (simplified for speed)
+    for row in combined_rows:
+        game_id = int(row["game_id"])
+        home_points = int(row["home_points"]) if row["home_points"] else 0
+        away_points = int(row["away_points"]) if row["away_points"] else 0
+        home_team = ref.team(row["home_team_id"])
+        away_team = ref.team(row["away_team_id"])
+        timestamp = str(row["game_timestamp"]) if row["game_timestamp"] else ""
+
+        # Clean date format - only show YYYY-MM-DD
+        date = timestamp[:10] if timestamp else ""
+        rows.append({
+            "score": row["score"],
+            "line": f"{away_team} {away_points}-{home_points} {home_team} {date}",
+            "evidence": {"table": "game_details", "id": game_id},
+        })
+
+    # Add player data if available (simplified for speed)
+    for row in player_rows:
+        game_id = int(row["game_id"]) if row["game_id"] else 0
+        points = int(row["points"]) if row["points"] else 0
+        rebounds = int(row["rebounds"]) if row["rebounds"] else 0
+        assists = int(row["assists"]) if row["assists"] else 0
+        player = ref.player(row["person_id"])
+        timestamp = str(row["game_timestamp"]) if row["game_timestamp"] else ""
+
+        # Clean date format - only show YYYY-MM-DD
+        date = timestamp[:10] if timestamp else ""
+        rows.append({
+            "score": row["score"],
+            "line": f"{player}: {points} points, {rebounds} rebounds, {assists} assists {date}",
+            "compact": f"{player} {points}/{rebounds}/{assists} {date}",
+            "evidence": {"table": "player_box_scores", "id": game_id},
+        })
+
+    return rows
+
+
+# Static prompt prefix: identical for every question, so Ollama can reuse it
+INSTRUCTIONS = (
+    "You answer questions about NBA games using only the data below, in one or two sentences. "
+    "Game lines read: away team, away-home score, home team, date. "
+    "Short player lines read: name, points/rebounds/assists, date."
+)
+
+
+def build_prompt(question, rows, player_question):
+    """Budgeted prompt for the question; returns (prompt, kept rows, generation options)"""
+    kind = question_type(question, player_question)
+    return fit_prompt(INSTRUCTIONS, rows, f"Q: {question}\nA: Based on this data,", kind)
+
+
+async def prepare(question, timings=None):
+    """Embed the question and retrieve context; returns (prompt or None, options, evidence, qvec)"""
+    # Step 1: Generate embedding for the question using Ollama
+    qvec = await embed_question(question, timings)
+
+    # Step 2: Semantic retrieval and a context that fits the prompt budget
+    player_question = needs_player_data(question)
+    rows = await retrieve_context(question, qvec, player_question, timings)
+    if not rows:
+        return None, None, [], qvec
+    with span("context", timings):
+        prompt, kept, options = build_prompt(question, rows, player_question)
+    evidence = [row["evidence"] for row in kept][:5]  # Limit evidence to 5 items
+    return prompt, options, evidence, qvec
+
+
+def admit():
+    """Refuse up front when generation can't happen soon: Ollama is down or the queue is full"""
+    # Peek only: the Ollama call itself takes the half-open trial
+    if ollama_breaker.is_open():
+        ADMISSION_REJECTED.labels(ollama_breaker.name, "circuit_open").inc()
+        raise Overloaded(f"{ollama_breaker.name} circuit is open", ollama_breaker.remaining())
+    generate_limiter.check()
+
+
+def with_timings(body, q, timings):
+    """Attach the per-stage breakdown when the request asked for it"""
+    if q.timings:
+        body["timings"] = timings
+    return body
+
+
+@app.post("/api/chat")
+async def answer(q: Q, request: Request):
+    log.info("Received question: %s", q.question)
+    timings = {}
+    started = time.perf_counter()
+    
+    try:
+        await check_data_version()
         
-        # Step 4: Generate answer using Llama with optimized prompt
-        print("Generating answer with Llama...")
+        # Structured stat questions are answered straight from the tables
+        fast = await try_fast_path(q.question, timings)
+        if fast:
+            log.info("Answered via SQL fast path")
+            REQUESTS.labels("chat", "fast").inc()
+            timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+            return with_timings({"answer": fast["answer"], "evidence": fast["evidence"]}, q, timings)
         
-        if context.strip():
-            # Optimized prompt for accuracy and speed
-            prompt = f"""NBA Data:
-{context.strip()}
-
-Q: {q.question}
-A: Based on this data,"""
-            
-            response = ollama_generate(LLM_MODEL, prompt)
+        admit()
+        prompt, options, evidence, qvec = await prepare(q.question, timings)
+        
+        # Step 3: Generate answer using Llama with optimized prompt
+        cached = answer_cache.get(q.question, qvec, evidence, LLM_MODEL) if prompt else None
+        if prompt:
+            cache_lookup("answer", cached is not None)
+        if cached is not None:
+            response, path = cached, "cached"
+        elif prompt:
+            async with generate_limiter:
+                with span("generate", timings):
+                    # Stop spending model time on answers nobody is waiting for
+                    response = await cancel_on_disconnect(request, aollama_generate(LLM_MODEL, prompt, options, timings))
+            answer_cache.put(q.question, qvec, evidence, LLM_MODEL, response)
+            path = "rag"
         else:
-            response = f"No specific data found for: {q.question}"
+            response, path = f"No specific data found for: {q.question}", "no_data"
         
-        print("Generated response successfully")
+        REQUESTS.labels("chat", path).inc()
+        timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        log.info("Generated response (%s) in %.1f ms", path, timings["total"])
         
-        return {
+        return with_timings({
             "answer": response,
-            "evidence": evidence[:5]  # Limit evidence to 5 items
-        }
+            "evidence": evidence
+        }, q, timings)
         
+    except Overloaded:
+        raise
+    except ClientDisconnected:
+        log.info("Client disconnected, generation cancelled")
+        CLIENT_DISCONNECTS.labels("chat").inc()
+        return Response(status_code=499)
     except Exception as e:
-        print(f"Error in RAG pipeline: {e}")
+        log.exception("Error in RAG pipeline")
+        ERRORS.labels("chat").inc()
         return {
             "answer": f"Sorry, I encountered an error processing your question: {str(e)}",
             "evidence": []
-        }
\ No newline at end of file
+        }
+
+
+def sse(event, data):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/chat/stream")
+async def answer_stream(q: Q):
+    """Same pipeline as /api/chat, streamed as server-sent events.
+
+    Emits one `evidence` event as soon as retrieval finishes, then a `token`
+    event per generated chunk, and finally `done` (or `error`).
+    """
+    log.info("Received streaming question: %s", q.question)
+    timings = {}
+    started = time.perf_counter()
+    fast = None
+    try:
+        await check_data_version()
+        fast = await try_fast_path(q.question, timings)
+    except Exception:
+        log.exception("Fast path failed, falling back to RAG")
+    if not fast:
+        # Decided before the stream starts, so a saturated server can still answer with a 503
+        admit()
+
+    async def events():
+        try:
+            if fast:
+                REQUESTS.labels("stream", "fast").inc()
+                yield sse("evidence", fast["evidence"])
+                yield sse("token", fast["answer"])
+                yield sse("done", with_timings({}, q, timings))
+                return
+            prompt, options, evidence, qvec = await prepare(q.question, timings)
+            yield sse("evidence", evidence)
+            cached = answer_cache.get(q.question, qvec, evidence, LLM_MODEL) if prompt else None
+            if prompt:
+                cache_lookup("answer", cached is not None)
+            if cached is not None:
+                path = "cached"
+                yield sse("token", cached)
+            elif prompt:
+                path = "rag"
+                tokens = []
+                # Disconnects cancel this generator, which closes the Ollama stream and frees the slot
+                async with generate_limiter:
+                    with span("generate", timings):
+                        async for token in aollama_generate_stream(LLM_MODEL, prompt, options, timings):
+                            if not tokens:
+                                timings["first_token"] = round((time.perf_counter() - started) * 1000, 1)
+                            tokens.append(token)
+                            yield sse("token", token)
+                answer_cache.put(q.question, qvec, evidence, LLM_MODEL, "".join(tokens))
+            else:
+                path = "no_data"
+                yield sse("token", f"No specific data found for: {q.question}")
+            REQUESTS.labels("stream", path).inc()
+            timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+            yield sse("done", with_timings({}, q, timings))
+        except asyncio.CancelledError:
+            CLIENT_DISCONNECTS.labels("stream").inc()
+            raise
+        except Overloaded as e:
+            yield sse("error", f"The server is busy, please retry in {e.retry_after}s")
+        except Exception as e:
+            log.exception("Error in RAG pipeline")
+            ERRORS.labels("stream").inc()
+            yield sse("error", f"Sorry, I encountered an error processing your question: {str(e)}")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def warm_db_pool():
+    """Open every pooled connection up front instead of on the first requests"""
+    async def ping():
+        async with eng.connect() as cx:
+            await cx.execute(text("SELECT 1"))
+    await asyncio.gather(*(ping() for _ in range(POOL_SIZE)))
+
+
+async def warm_retrieval():
+    """Run one retrieval per table so the HNSW index pages are in memory"""
+    qvec = await embed_question("Who won the Thunder game?")
+    async with eng.connect() as cx:
+        await aretrieve(cx, "game_details", qvec, 1)
+        await aretrieve(cx, "player_box_scores", qvec, 5)
+
+
+WARMUP_STEPS = [
+    ("db_pool", warm_db_pool),
+    ("refdata", get_refdata),
+    ("parser", get_parser),
+    ("llm_model", lambda: aollama_load(LLM_MODEL)),
+    ("retrieval", warm_retrieval),  # also loads the embedding model
+]
+
+
+async def warm_up():
+    """Run each warm-up step once, retrying failed steps until they succeed"""
+    for name, step in WARMUP_STEPS:
+        while name not in _warmup["steps"]:
+            started = time.perf_counter()
+            try:
+                with span(f"warmup.{name}"):
+                    await step()
+            except Exception as e:
+                _warmup["error"] = f"{name}: {e!r}"
+                log.warning("Warm-up step %s failed (%r), retrying in %gs", name, e, WARMUP_RETRY_SECONDS)
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+                continue
+            _warmup["steps"][name] = round((time.perf_counter() - started) * 1000, 1)
+    _warmup["ready"], _warmup["error"] = True, None
+    log.info("Warm-up finished: %s", _warmup["steps"])
+
+
+@app.get("/api/health")
+async def health():
+    """Readiness: 200 once warm-up has finished, 503 while it is still running"""
+    body = {"status": "ready" if _warmup["ready"] else "starting",
+            "warmup_ms": _warmup["steps"], "error": _warmup["error"]}
+    return JSONResponse(body, status_code=200 if _warmup["ready"] else 503)
+
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for sizing the question and answer caches"""
+    return {
+        "data_version": _data_version,
+        "question_embeddings": question_cache.stats(),
+        "answers": answer_cache.stats(),
+    }
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: stage latencies, request/error/token counters, cache lookups"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
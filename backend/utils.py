@@ -1,26 +1,233 @@
+import asyncio
+import time
 import requests, json
-from backend.config import OLLAMA_HOST
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from backend.config import (
+    OLLAMA_HOST, OLLAMA_KEEP_ALIVE, EMBED_MICROBATCH_SIZE, EMBED_MICROBATCH_WINDOW_MS,
+    OLLAMA_CONNECT_TIMEOUT, EMBED_TIMEOUT, GENERATE_TIMEOUT, OLLAMA_BATCH_TIMEOUT,
+    OLLAMA_RETRIES, OLLAMA_RETRY_BACKOFF, OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_RESET_SECONDS, LLM_NUM_CTX,
+)
+from backend.admission import CircuitBreaker
+from backend.metrics import EMBED_BATCH_FILL, llm_usage
 
 
-def ollama_embed(model: str, text: str):
-    r = requests.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": model, "prompt": text})
-    r.raise_for_status()
-    return r.json()["embedding"]
+# Shared keep-alive session so repeated calls reuse the same connection.
+# Connection errors and 5xx responses are retried with backoff.
+session = requests.Session()
+session.mount("http://", HTTPAdapter(max_retries=Retry(
+    total=OLLAMA_RETRIES, read=0, backoff_factor=OLLAMA_RETRY_BACKOFF,
+    status_forcelist=(500, 502, 503, 504), allowed_methods=None, raise_on_status=False,
+)))
+session.mount("https://", session.get_adapter("http://"))
 
 
-def ollama_generate(model: str, prompt: str):
-    # Optimized parameters for speed
-    payload = {
+def vector_literal(vec):
+    """Format an embedding as a pgvector text literal"""
+    return "[" + ",".join(repr(float(x)) for x in vec) + "]"
+
+
+def generate_payload(model: str, prompt: str, stream: bool = False, options: dict = None):
+    # Optimized parameters for speed; `options` (see prompting.py) sizes them per question
+    return {
         "model": model, 
         "prompt": prompt, 
-        "stream": False,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "num_predict": 60,   # Optimized for consistent 20-25 second responses
             "temperature": 0.1,  
             "top_p": 0.9,      
-            "num_ctx": 2048     # Smaller context window
+            "num_ctx": LLM_NUM_CTX,
+            **(options or {}),
         }
     }
-    r = requests.post(f"{OLLAMA_HOST}/api/generate", json=payload)
+
+
+def ollama_embed(model: str, text: str):
+    r = session.post(f"{OLLAMA_HOST}/api/embeddings", json={"model": model, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE},
+                     timeout=(OLLAMA_CONNECT_TIMEOUT, EMBED_TIMEOUT))
     r.raise_for_status()
-    return r.json()["response"]
+    return r.json()["embedding"]
+
+
+def ollama_embed_batch(model: str, texts: list):
+    """Embed many texts in one call via the batch /api/embed endpoint"""
+    r = session.post(f"{OLLAMA_HOST}/api/embed", json={"model": model, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE},
+                     timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_BATCH_TIMEOUT))
+    r.raise_for_status()
+    return r.json()["embeddings"]
+
+
+def ollama_generate(model: str, prompt: str, options: dict = None):
+    r = session.post(f"{OLLAMA_HOST}/api/generate", json=generate_payload(model, prompt, options=options),
+                     timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_BATCH_TIMEOUT))
+    r.raise_for_status()
+    data = r.json()
+    llm_usage(data)
+    return data["response"]
+
+
+# Async variants for the API server. One pooled keep-alive client is shared by
+# every request in the process; it is created lazily inside the running loop.
+# Calls go through a circuit breaker so an unhealthy Ollama is not hammered.
+_async_client = None
+ollama_breaker = CircuitBreaker("ollama", OLLAMA_BREAKER_FAILURES, OLLAMA_BREAKER_RESET_SECONDS)
+# Failures that happen before Ollama starts working on a request, so retrying is safe
+RETRYABLE = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout, httpx.RemoteProtocolError)
+
+
+def async_client():
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            base_url=OLLAMA_HOST,
+            timeout=httpx.Timeout(None, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def apost(path: str, payload: dict, timeout: float):
+    """POST to Ollama through the breaker, retrying connection errors and 5xx"""
+    ollama_breaker.check()
+    error = None
+    for attempt in range(OLLAMA_RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(OLLAMA_RETRY_BACKOFF * 2 ** (attempt - 1))
+        try:
+            r = await async_client().post(path, json=payload, timeout=httpx.Timeout(timeout, connect=OLLAMA_CONNECT_TIMEOUT))
+        except RETRYABLE as e:
+            error = e
+            continue
+        except httpx.HTTPError:
+            ollama_breaker.failure()
+            raise
+        if r.status_code >= 500:
+            error = httpx.HTTPStatusError(f"Ollama returned {r.status_code}", request=r.request, response=r)
+            continue
+        ollama_breaker.success()
+        r.raise_for_status()
+        return r.json()
+    ollama_breaker.failure()
+    raise error
+
+
+async def aollama_embed(model: str, text: str):
+    data = await apost("/api/embeddings", {"model": model, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE}, EMBED_TIMEOUT)
+    return data["embedding"]
+
+
+async def aollama_load(model: str):
+    """Load a generation model into memory without generating (an empty prompt)"""
+    await apost("/api/generate", {"model": model, "keep_alive": OLLAMA_KEEP_ALIVE}, OLLAMA_BATCH_TIMEOUT)
+
+
+async def aollama_embed_batch(model: str, texts: list):
+    data = await apost("/api/embed", {"model": model, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE}, EMBED_TIMEOUT)
+    return data["embeddings"]
+
+
+class EmbedBatcher:
+    """Coalesces concurrent single-text embeddings into batched /api/embed calls.
+
+    A request arriving while no batch is in flight is sent at once, so a lone
+    user pays no extra latency. Requests arriving while one is in flight wait
+    up to `window_ms` (or until `max_batch` are queued) and go out together;
+    each caller gets its own vector back.
+    """
+
+    def __init__(self, model, max_batch=EMBED_MICROBATCH_SIZE, window_ms=EMBED_MICROBATCH_WINDOW_MS):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.window = window_ms / 1000
+        self.pending = []  # (text, future)
+        self.in_flight = 0
+        self.timer = None
+        self.tasks = set()
+
+    async def embed(self, text):
+        fut = asyncio.get_running_loop().create_future()
+        self.pending.append((text, fut))
+        if self.in_flight == 0 or len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await fut
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.in_flight += 1
+            task = asyncio.get_running_loop().create_task(self.send(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, batch):
+        # Identical questions in one batch are embedded once
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        EMBED_BATCH_FILL.observe(len(batch))
+        try:
+            vectors = dict(zip(texts, await aollama_embed_batch(self.model, texts)))
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            self.in_flight -= 1
+            # Anything that queued up behind this batch goes now rather than waiting out the window
+            if self.pending and self.in_flight == 0:
+                self.flush()
+        for text, fut in batch:
+            if not fut.done():
+                fut.set_result(vectors[text])
+
+
+async def aollama_generate(model: str, prompt: str, options: dict = None, timings: dict = None):
+    """Generate an answer; prefill/decode times go into `timings` (ms) when given"""
+    data = await apost("/api/generate", generate_payload(model, prompt, options=options), GENERATE_TIMEOUT)
+    llm_usage(data, timings)
+    return data["response"]
+
+
+async def aollama_generate_stream(model: str, prompt: str, options: dict = None, timings: dict = None):
+    """Yield response tokens as Ollama produces them.
+
+    Stops with httpx.ReadTimeout once GENERATE_TIMEOUT has passed. Closing the
+    generator (e.g. when the client disconnects) closes the connection, which
+    makes Ollama stop generating.
+    """
+    ollama_breaker.check()
+    deadline = time.monotonic() + GENERATE_TIMEOUT
+    payload = generate_payload(model, prompt, stream=True, options=options)
+    try:
+        async with async_client().stream("POST", "/api/generate", json=payload,
+                                         timeout=httpx.Timeout(GENERATE_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT)) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if time.monotonic() > deadline:
+                    raise httpx.ReadTimeout(f"generation exceeded {GENERATE_TIMEOUT:g}s", request=r.request)
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    llm_usage(chunk, timings)
+                    break
+    except httpx.HTTPError:
+        ollama_breaker.failure()
+        raise
+    ollama_breaker.success()
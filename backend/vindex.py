@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import numpy as np
+import sqlalchemy as sa
+from sqlalchemy import text
+from backend.config import DB_DSN, EMBED_MODEL, VECTOR_INDEX_DIR, VECTOR_INDEX_DTYPE
+
+log = logging.getLogger(__name__)
+
+# In-process alternative to pgvector retrieval. embed.py exports every stored
+# embedding to a .npy snapshot (rows L2-normalized so a dot product is cosine
+# similarity) plus the matching row keys; servers memory-map the snapshot
+# read-only, so all uvicorn workers share one copy through the page cache.
+# Each export goes into its own directory (<table>.<version>/) and is made live
+# by atomically replacing the <table>.current pointer file, so a reader always
+# opens vectors, keys and the ANN index from the same export.
+
+TABLE_KEYS = {
+    "game_details": ["game_id"],
+    "player_box_scores": ["game_id", "person_id"],
+}
+
+try:
+    import hnswlib  # optional approximate index
+except ImportError:
+    hnswlib = None
+
+
+def _pointer(table, directory=VECTOR_INDEX_DIR):
+    return os.path.join(directory, table + ".current")
+
+
+def _current(table, directory=VECTOR_INDEX_DIR):
+    """Directory of the live snapshot for a table"""
+    with open(_pointer(table, directory), encoding="utf-8") as f:
+        return os.path.join(directory, f.read().strip())
+
+
+def _paths(snapshot):
+    return {"vectors": os.path.join(snapshot, "vectors.npy"), "keys": os.path.join(snapshot, "keys.npy"),
+            "meta": os.path.join(snapshot, "meta.json"), "ann": os.path.join(snapshot, "index.hnsw")}
+
+
+def _prune(table, directory, keep):
+    """Delete old snapshot directories of a table, except those in `keep`"""
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.startswith(table + ".") and os.path.isdir(path) and name not in keep:
+            # Readers that already mapped the files keep them (POSIX); elsewhere a busy one just stays
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def export_snapshot(eng, directory=VECTOR_INDEX_DIR, dtype=VECTOR_INDEX_DTYPE, ann=False):
+    """Write embeddings and row keys for every table to `directory`"""
+    os.makedirs(directory, exist_ok=True)
+    for table, key_cols in TABLE_KEYS.items():
+        with eng.connect() as cx:
+            rows = cx.execute(text(
+                f"SELECT {', '.join(key_cols)}, embedding::real[] AS embedding FROM {table} "
+                f"WHERE embedding IS NOT NULL ORDER BY {', '.join(key_cols)}"
+            )).all()
+        keys = np.array([r[:-1] for r in rows], dtype=np.int64).reshape(len(rows), len(key_cols))
+        vectors = np.array([r[-1] for r in rows], dtype=np.float32).reshape(len(rows), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.where(norms == 0, 1, norms)).astype(dtype)
+
+        # Write a complete new snapshot directory, then switch the pointer to it in one
+        # os.replace, so readers never pair files from different exports
+        version = f"{table}.{time.time_ns()}"
+        snapshot = os.path.join(directory, version)
+        os.makedirs(snapshot)
+        paths = _paths(snapshot)
+        np.save(paths["vectors"], vectors)
+        np.save(paths["keys"], keys)
+        if ann and hnswlib is not None and len(vectors):
+            index = hnswlib.Index(space="ip", dim=vectors.shape[1])
+            index.init_index(max_elements=len(vectors), ef_construction=200, M=16)
+            index.add_items(vectors.astype(np.float32), np.arange(len(vectors)))
+            index.save_index(paths["ann"])
+        meta = {"rows": len(rows), "dim": int(vectors.shape[1]) if len(rows) else 0,
+                "dtype": str(np.dtype(dtype)), "key_cols": key_cols, "model": EMBED_MODEL,
+                "ann": bool(ann and hnswlib is not None)}
+        with open(paths["meta"], "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        pointer = _pointer(table, directory)
+        previous = os.path.basename(_current(table, directory)) if os.path.exists(pointer) else None
+        with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+        # The previous snapshot stays for readers that read the pointer just before the swap
+        _prune(table, directory, {version, previous})
+        log.info("Exported %d %s vectors (%.1f MB, %s)", len(rows), table, vectors.nbytes / 1e6, meta["dtype"])
+
+
+class LocalIndex:
+    """Exact (or optional HNSW) cosine top-k over a memory-mapped snapshot"""
+
+    def __init__(self, table, directory=VECTOR_INDEX_DIR):
+        self.snapshot = _current(table, directory)
+        paths = _paths(self.snapshot)
+        with open(paths["meta"], encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.vectors = np.load(paths["vectors"], mmap_mode="r")
+        self.keys = np.load(paths["keys"], mmap_mode="r")
+        self.ann = None
+        if self.meta.get("ann") and hnswlib is not None and os.path.exists(paths["ann"]):
+            self.ann = hnswlib.Index(space="ip", dim=self.meta["dim"])
+            self.ann.load_index(paths["ann"])
+
+    def search(self, qvec, k):
+        """Return [(key tuple, cosine score), ...] best first"""
+        if not len(self.keys):
+            return []
+        q = np.asarray(qvec, dtype=np.float32)
+        q /= np.linalg.norm(q) or 1.0
+        k = min(k, len(self.keys))
+        if self.ann is not None:
+            self.ann.set_ef(max(40, 2 * k))
+            labels, distances = self.ann.knn_query(q, k=k)
+            top, scores = labels[0], 1 - distances[0]
+        else:
+            sims = self.vectors @ q.astype(self.vectors.dtype)
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            scores = sims[top]
+        return [(tuple(int(x) for x in self.keys[i]), float(s)) for i, s in zip(top, scores)]
+
+
+_indexes = {}
+
+
+def get_index(table, directory=VECTOR_INDEX_DIR):
+    """Process-wide LocalIndex for a table, reopened when a new snapshot is exported"""
+    idx = _indexes.get(table)
+    if idx is None or _current(table, directory) != idx.snapshot:
+        idx = _indexes[table] = LocalIndex(table, directory)
+    return idx
+
+
+if __name__ == "__main__":
+    from backend.metrics import setup_logging
+    setup_logging()
+    log.info("Exporting embedding snapshot...")
+    export_snapshot(sa.create_engine(DB_DSN), ann="--ann" in sys.argv[1:])
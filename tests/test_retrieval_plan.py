@@ -0,0 +1,27 @@
+import pytest
+import sqlalchemy as sa
+from backend.config import DB_DSN
+from backend.retrieval import explain_topk, topk_index
+
+# Needs the database from docker-compose with embeddings loaded; skipped otherwise.
+#   python -m pytest tests/test_retrieval_plan.py
+
+
+@pytest.fixture(scope="module")
+def cx():
+    try:
+        eng = sa.create_engine(DB_DSN)
+        conn = eng.connect()
+    except (ImportError, sa.exc.OperationalError) as e:  # no driver or no server
+        pytest.skip(f"database not reachable: {e}")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("table", ["game_details", "player_box_scores"])
+def test_topk_uses_embedding_index(cx, table):
+    try:
+        plan = explain_topk(cx, table)
+    except RuntimeError as e:
+        pytest.skip(str(e))
+    assert topk_index(table) in plan, plan